@@ -39,4 +39,9 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
     
+    # Heavy dependencies (TensorFlow, FaceNet, embedding cache) load in the background
+    if app.config.get('WARMUP_ON_STARTUP'):
+        from app.api.routes import start_warmup
+        start_warmup()
+    
     return app
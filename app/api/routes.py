@@ -1,16 +1,27 @@
 import asyncio
+import json
 import logging
-from flask import request, jsonify, current_app
+import threading
+import numpy as np
+from flask import request, jsonify, Response
 from app.api import bp
+from app.config import Config
 from app.services.face_service import FaceDetectionService, ClusteringService
-from app.utils.image_processor import FileScanner, ImageProcessor
+from app.services.cluster_results import ClusterResult, ClusterResultStore
+from app.services.cluster_cache import ClusterCache, result_key
+from app.utils.image_processor import FileScanner
 from app.utils.cache_manager import EmbeddingCache, MetadataManager
+from app.utils.detection_set import DetectionSet
 
 logger = logging.getLogger(__name__)
 
-# Global services
-face_service = FaceDetectionService()
-embedding_cache = EmbeddingCache()
+# Global services (cheap to create: the model and the cache are loaded on first use)
+embedding_cache = EmbeddingCache(lazy=True)
+face_service = FaceDetectionService(embedding_cache=embedding_cache)
+
+# Background warm-up state, reported by /health
+warmup_state = {'status': 'idle', 'error': None}
+_warmup_lock = threading.Lock()
 
 # Global progress tracking
 progress_data = {}
@@ -18,6 +29,50 @@ progress_data = {}
 # Store extracted faces data for clustering step
 extracted_faces_cache = {}
 
+# Clustering results, served page by page
+cluster_results = ClusterResultStore()
+
+# Clustering results memoised on disk by (detections, algorithm, parameters)
+cluster_cache = ClusterCache()
+
+def _save_cluster_result(result: ClusterResult) -> None:
+    """Append the preview faces cropped since the last call to the clustering cache"""
+    if result.cache_key is None:
+        return
+    records = result.unsaved_records()
+    if records and not cluster_cache.append(result.cache_key, records):
+        result.cache_key = None  # Dropped (evicted or over budget): stop writing crops
+
+def _warm_up_services():
+    """Load the embedding cache and the FaceNet model ahead of the first request"""
+    try:
+        embedding_cache.ensure_loaded()
+        face_service.load_model()
+        warmup_state['status'] = 'done'
+        logger.info("Services warmed up")
+    except Exception as e:
+        warmup_state['status'] = 'failed'
+        warmup_state['error'] = str(e)
+        logger.error(f"Error warming up services: {e}")
+
+def start_warmup():
+    """Start the warm-up in a daemon thread (only once per process)"""
+    with _warmup_lock:
+        if warmup_state['status'] != 'idle':
+            return
+        warmup_state['status'] = 'running'
+    threading.Thread(target=_warm_up_services, name='warmup', daemon=True).start()
+
+def services_readiness():
+    """Readiness of the heavy dependencies, without triggering their loading"""
+    return {
+        'ready': face_service.is_ready and embedding_cache.is_loaded,
+        'model_loaded': face_service.is_ready,
+        'model_error': face_service.load_error,
+        'cache_loaded': embedding_cache.is_loaded,
+        'warmup': warmup_state['status']
+    }
+
 def update_progress(stage, percentage, message, **kwargs):
     """Update progress for a specific stage"""
     progress_data[stage] = {
@@ -64,17 +119,12 @@ def extract_faces():
             return jsonify({'error': 'No images found in directory'}), 404
         
         # Process faces (check cache first)
-        all_detections = []
-        uncached_paths = []
-        
-        for path in image_paths:
-            cached_detections = embedding_cache.get(path)
-            if cached_detections is not None:
-                all_detections.extend(cached_detections)
-            else:
-                uncached_paths.append(path)
+        cached_detections, uncached_paths = embedding_cache.get_many(image_paths)
+        all_detections = cached_detections
         
         new_embeddings = 0
+        rejected_faces = 0
+        deduplicated_images = 0
         # Process uncached images
         if uncached_paths:
             logger.info(f"Processing {len(uncached_paths)} uncached images")
@@ -85,7 +135,9 @@ def extract_faces():
             asyncio.set_event_loop(loop)
             
             try:
-                new_detections = []
+                new_sets = []
+                report = {}
+                faces_found = 0
                 total_images = len(uncached_paths)
                 
                 # Process images in batches to update progress
@@ -98,31 +150,38 @@ def extract_faces():
                     update_progress('extraction', progress_pct, 
                                   f'Traitement: {i + len(batch)}/{total_images} images',
                                   processed=i + len(batch),
-                                  faces_found=len(new_detections))
+                                  faces_found=faces_found)
                     
                     # Process this batch
-                    batch_detections = loop.run_until_complete(
-                        face_service.detect_faces_async(batch)
+                    batch_report = {}
+                    batch_detections, batch_processed = loop.run_until_complete(
+                        face_service.detect_faces_async(batch, batch_report)
                     )
-                    new_detections.extend(batch_detections)
+                    # Cache each batch right away: near-duplicates in later batches
+                    # read their source's detections back from the cache
+                    embedding_cache.set_many(batch_detections, batch_processed,
+                                             batch_report.get('annotations'))
+                    for counter in ('rejected_faces', 'deduplicated_images'):
+                        report[counter] = report.get(counter, 0) + batch_report.get(counter, 0)
+                    new_sets.append(batch_detections)
+                    faces_found += len(batch_detections)
                 
                 update_progress('extraction', 95, 'Mise en cache des résultats...')
                 
-                # Cache new detections
-                for detection in new_detections:
-                    path = detection['image_path']
-                    path_detections = [d for d in new_detections if d['image_path'] == path]
-                    embedding_cache.set(path, path_detections)
+                new_detections = DetectionSet.concat(new_sets)
+                embedding_cache.save_cache()
                 
-                all_detections.extend(new_detections)
+                all_detections = DetectionSet.concat([cached_detections, new_detections])
                 new_embeddings = len(new_detections)
+                rejected_faces = report.get('rejected_faces', 0)
+                deduplicated_images = report.get('deduplicated_images', 0)
                 
             finally:
                 loop.close()
         else:
             update_progress('extraction', 90, 'Utilisation du cache existant...')
         
-        if not all_detections:
+        if not len(all_detections):
             return jsonify({'error': 'No faces detected in images'}), 404
         
         update_progress('extraction', 100, 'Extraction terminée !')
@@ -138,6 +197,8 @@ def extract_faces():
             'total_images': len(image_paths),
             'new_embeddings': new_embeddings,
             'cached_embeddings': len(all_detections) - new_embeddings,
+            'rejected_faces': rejected_faces,  # Discarded by the quality gate
+            'deduplicated_images': deduplicated_images,  # Reused a near-duplicate's detections
             'vector_dimensions': 512,  # FaceNet embedding dimension
             'cache_key': cache_key  # Key to retrieve data for clustering
         })
@@ -146,6 +207,39 @@ def extract_faces():
         logger.error(f"Error extracting faces: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _run_clustering(faces_data: DetectionSet, algorithm: str, params: dict, key: str) -> ClusterResult:
+    """Cluster the faces and compute the result statistics"""
+    reassignment = {}
+    labels = ClusteringService.cluster_faces(
+        faces_data, algorithm, report=reassignment, **params
+    )
+    
+    update_progress('clustering', 70, 'Organisation des clusters...')
+    
+    # Calculate statistics
+    total_faces = len(faces_data)
+    clustered_faces = int((labels != -1).sum()) if len(labels) else 0
+    unique_clusters = len(set(labels[labels != -1].tolist())) if len(labels) else 0
+
+    update_progress('clustering', 90, 'Calcul des statistiques...',
+                   clustered=clustered_faces,
+                   total_faces=total_faces)
+    
+    clustering_rate = clustered_faces / total_faces if total_faces > 0 else 0
+    
+    statistics = {
+        'total_faces': total_faces,
+        'clustered_faces': clustered_faces,
+        'num_clusters': unique_clusters,
+        'clustering_rate': clustering_rate,
+        'noise_points': total_faces - clustered_faces
+    }
+    if reassignment:
+        statistics['noise_reassignment'] = reassignment
+    # A failed clustering (empty labels) is not memoised
+    return ClusterResult(faces_data, labels, statistics, algorithm, params,
+                         cache_key=key if len(labels) == total_faces else None)
+
 @bp.route('/faces/cluster', methods=['POST'])
 def cluster_faces_from_data():
     """Cluster faces from pre-extracted data (Step 2)"""
@@ -164,64 +258,132 @@ def cluster_faces_from_data():
             return jsonify({'error': 'Extracted faces data not found. Please run extraction first.'}), 404
         
         faces_data = extracted_faces_cache[cache_key]
+        embedding_cache.mark_clustered(faces_data.paths)
         
         # Algorithm-specific parameters
         params = {}
         if algorithm == 'dbscan':
             params['eps'] = float(data.get('eps', 0.65))
             params['min_samples'] = int(data.get('min_samples', 3))
+            params['reassign_noise'] = bool(data.get('reassign_noise', Config.NOISE_REASSIGNMENT))
+            if params['reassign_noise'] and data.get('noise_distance'):
+                params['noise_distance'] = float(data['noise_distance'])
         elif algorithm in ['kmeans', 'hierarchical']:
             params['n_clusters'] = int(data.get('n_clusters', 20))
         
-        if not faces_data:
+        if not len(faces_data):
             return jsonify({'error': 'No faces data available'}), 404
         
         update_progress('clustering', 10, 'Initialisation du clustering...',
                        total_faces=len(faces_data))
         
-        # Perform clustering on the provided faces data
-        labels, paths = ClusteringService.cluster_faces(
-            faces_data, algorithm, **params
-        )
+        # Identical request on the same detections: reuse the memoised result
+        # Cached labels are in canonical row order, independent of extraction order
+        key = result_key(faces_data.fingerprint(), algorithm, params)
+        order = faces_data.canonical_order()
+        cached = cluster_cache.get(key)
+        if cached is not None:
+            canonical_labels, metadata, records = cached
+            labels = np.empty_like(canonical_labels)
+            labels[order] = canonical_labels
+            result = ClusterResult(faces_data, labels, metadata['statistics'],
+                                   algorithm, params, cache_key=key, records=records)
+            logger.info(f"Clustering result {key} served from cache")
+        else:
+            result = _run_clustering(faces_data, algorithm, params, key)
+            if result.cache_key is not None and not cluster_cache.put(
+                    key, result.labels[order], result.cache_metadata()):
+                result.cache_key = None
+        
+        # Keep the result server-side; only the first page is sent now
+        cluster_results.put(result)
+        first_page = result.page(1, int(data.get('per_page', Config.PAGINATION_PER_PAGE)),
+                                 face_service.executor)
+        # Mean cohesion and merge suggestions cover every cluster: large results are
+        # analysed in the background, the client polls /summaries
+        analysis = result.start_analysis(face_service.executor)
+        _save_cluster_result(result)
+        if analysis is not None:
+            analysis.add_done_callback(lambda _: _save_cluster_result(result))
         
-        update_progress('clustering', 70, 'Organisation des clusters...')
+        update_progress('clustering', 100, 'Clustering terminé !')
         
-        # Organize results by cluster
-        clusters = ClusteringService.organize_clusters(faces_data, labels, paths)
+        return jsonify({
+            'status': 'success',
+            'result_id': result.result_id,
+            'clusters': first_page['clusters'],
+            'pagination': first_page['pagination'],
+            'statistics': result.statistics,
+            'summaries': result.summary(),
+            'algorithm_used': algorithm,
+            'parameters': params
+        })
         
-        # Calculate statistics
-        total_faces = len(faces_data)
-        clustered_faces = sum(1 for label in labels if label != -1)
-        unique_clusters = len(set(label for label in labels if label != -1))
+    except Exception as e:
+        logger.error(f"Error clustering faces: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        update_progress('clustering', 90, 'Calcul des statistiques...',
-                       clustered=clustered_faces,
-                       total_faces=total_faces)
+@bp.route('/faces/clusters/<result_id>', methods=['GET'])
+def get_cluster_page(result_id):
+    """Get one page of a clustering result, largest clusters first"""
+    try:
+        result = cluster_results.get(result_id)
+        if result is None:
+            return jsonify({'error': 'Clustering result not found. Please run clustering again.'}), 404
         
-        clustering_rate = clustered_faces / total_faces if total_faces > 0 else 0
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', Config.PAGINATION_PER_PAGE, type=int)
         
-        statistics = {
-            'total_faces': total_faces,
-            'clustered_faces': clustered_faces,
-            'num_clusters': unique_clusters,
-            'clustering_rate': clustering_rate,
-            'noise_points': total_faces - clustered_faces
-        }
-        
-        update_progress('clustering', 100, 'Clustering terminé !')
+        page_data = result.page(page, per_page, face_service.executor)
+        _save_cluster_result(result)
         
         return jsonify({
             'status': 'success',
-            'clusters': clusters,
-            'statistics': statistics,
-            'algorithm_used': algorithm,
-            'parameters': params
+            'result_id': result_id,
+            'summaries': result.summary(),
+            **page_data
         })
         
     except Exception as e:
-        logger.error(f"Error clustering faces: {e}")
+        logger.error(f"Error getting cluster page: {e}")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/faces/clusters/<result_id>/summaries', methods=['GET'])
+def get_cluster_summaries(result_id):
+    """Result-wide analysis (mean cohesion, merge suggestions) once computed"""
+    result = cluster_results.get(result_id)
+    if result is None:
+        return jsonify({'error': 'Clustering result not found. Please run clustering again.'}), 404
+    return jsonify({'status': 'success', 'result_id': result_id, 'summaries': result.summary()})
+
+@bp.route('/faces/clusters/<result_id>/stream', methods=['GET'])
+def stream_clusters(result_id):
+    """Stream a clustering result as NDJSON, one cluster per line"""
+    result = cluster_results.get(result_id)
+    if result is None:
+        return jsonify({'error': 'Clustering result not found. Please run clustering again.'}), 404
+    
+    def generate():
+        summaries = result.summary()
+        yield json.dumps({
+            'type': 'result',
+            'result_id': result_id,
+            'statistics': result.statistics,
+            'summaries': summaries,
+            'total_clusters': result.total_clusters
+        }) + '\n'
+        try:
+            for cluster in result.iter_clusters(face_service.executor):
+                yield json.dumps({'type': 'cluster', **cluster}) + '\n'
+            if not summaries['ready']:
+                yield json.dumps({'type': 'summaries', **result.summary(wait=True)}) + '\n'
+            _save_cluster_result(result)
+        except Exception as e:
+            logger.error(f"Error streaming clusters: {e}")
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @bp.route('/metadata/add', methods=['POST'])
 def add_metadata():
     """Add face names to image metadata"""
@@ -318,38 +480,3 @@ def cancel_process():
     except Exception as e:
         logger.error(f"Error cancelling process: {e}")
         return jsonify({'error': str(e)}), 500
-
-def _create_cluster_results(labels, paths, detections):
-    """Create formatted cluster results for frontend"""
-    from app.config import Config
-    from app.utils.cache_manager import convert_numpy_types
-    
-    clusters = {}
-    
-    for i, label in enumerate(labels):
-        # Convert numpy int64 to regular int
-        label = int(label) if hasattr(label, 'item') else label
-        
-        if label == -1:  # Noise/unclustered
-            continue
-        
-        if label not in clusters:
-            clusters[label] = {
-                'faces': [],
-                'paths': [],
-                'count': 0
-            }
-        
-        clusters[label]['paths'].append(paths[i])
-        clusters[label]['count'] += 1
-        
-        # Add face images (limited number for performance)
-        if len(clusters[label]['faces']) < Config.MAX_FACES_PER_CLUSTER:
-            face_image, success = ImageProcessor.crop_face(
-                paths[i], detections[i]['box']
-            )
-            if success:
-                clusters[label]['faces'].append(face_image)
-    
-    # Convert all numpy types in the clusters dictionary
-    return convert_numpy_types(clusters)
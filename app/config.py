@@ -9,16 +9,58 @@ class Config:
     FACE_DETECTION_THRESHOLD = 0.8
     MAX_IMAGE_SIZE = 800
     MAX_FACES_PER_CLUSTER = 6
+    MTCNN_MIN_FACE_SIZE = 20             # Smallest detectable face at MAX_IMAGE_SIZE (px)
+    
+    # Adaptive Detection Settings (coarse-to-fine, boxes stored at MAX_IMAGE_SIZE scale)
+    # Off by default: better crops of small faces, but no cheaper than a single pass
+    ADAPTIVE_DETECTION = False
+    ADAPTIVE_PROXY_SIZE = 320            # First pass resolution
+    ADAPTIVE_MAX_SIZE = 1600             # Resolution used to re-examine regions
+    ADAPTIVE_CANDIDATE_THRESHOLD = 0.5   # Proxy detections kept as candidates
+    ADAPTIVE_MIN_FACE_SIZE = 24          # Proxy faces smaller than this (px) are re-examined
+    ADAPTIVE_REGION_MARGIN = 1.5         # Region margin around a face, in face sizes
+    ADAPTIVE_MAX_REGIONS = 6             # Above this, the whole image is re-examined
+    ADAPTIVE_RESCAN_EMPTY = True         # Retry at MAX_IMAGE_SIZE when the proxy finds nothing
+    
+    # Face Quality Gate (between detection and embedding)
+    QUALITY_GATE = True
+    QUALITY_MIN_FACE_SIZE = 20           # Shortest box side, in pixels of the image the face is cropped from
+    QUALITY_MAX_YAW = 0.6                # Nose offset from the eyes' midpoint / eye distance
+    QUALITY_MIN_SHARPNESS = 20.0         # Variance of the Laplacian of the 64x64 gray face
+    
+    # Near-duplicate Images (perceptual hash of the decoded image)
+    PHASH_DEDUP = True
+    PHASH_MAX_DISTANCE = 4               # Hamming distance (out of 64 bits) to reuse detections
+    PHASH_INDEX_MAX_ENTRIES = 50000
     
     # Clustering Settings
     DEFAULT_DBSCAN_EPS = 0.65
     DEFAULT_DBSCAN_MIN_SAMPLES = 3
     DEFAULT_K_CLUSTERS = 20
+    NOISE_REASSIGNMENT = False            # Second pass attaching DBSCAN noise faces
+    NOISE_REASSIGN_DISTANCE_FACTOR = 1.25 # Default distance to a core point, in eps units
+    CLUSTER_MERGE_TOP_K = 3               # Nearest clusters (centroid similarity) per cluster
+    CLUSTER_MERGE_MIN_SIMILARITY = 0.7    # Cosine similarity for a merge suggestion
+    CLUSTER_MERGE_MAX_SUGGESTIONS = 20
+    CLUSTER_ANALYSIS_BLOCK_SIZE = 1024    # Rows of the centroid similarity matrix per block
+    CLUSTER_ANALYSIS_SYNC_MAX_CLUSTERS = 2000  # Analysed before the first response (about 0.25 s)
     
     # Performance Settings
     CHUNK_SIZE = 20
     CACHE_TIMEOUT = timedelta(hours=24)  # Increased cache timeout to 24 hours
     MAX_WORKERS = 4
+    SHARD_CHUNK_SIZE = 200  # Images per checkpoint in headless sharded extraction
+    WARMUP_ON_STARTUP = True  # Load model and cache in a background thread at startup
+    
+    # Model Server Settings (optional inference daemon shared by all web workers)
+    MODEL_SERVER_SOCKET = os.environ.get('FACE_MODEL_SOCKET')  # None: in-process inference
+    MODEL_SERVER_MAX_BATCH = 16
+    MODEL_SERVER_BATCH_WAIT_MS = 10
+    MODEL_SERVER_QUEUE_SIZE = 256
+    MODEL_SERVER_TIMEOUT = 120
+    MODEL_SERVER_RETRY_INTERVAL = 30  # Seconds between availability checks
+    MODEL_SERVER_RETRIES = 2  # Retries of a request the server rejected (e.g. queue full)
+    MODEL_SERVER_LOCAL_FALLBACK = False  # Run rejected requests in-process (loads FaceNet in the worker)
     
     # File Settings
     EMBEDDINGS_FILE = "./cache/embeddings_cache.json"
@@ -28,15 +70,25 @@ class Config:
     
     # API Settings
     PAGINATION_PER_PAGE = 50
+    PAGINATION_MAX_PER_PAGE = 500
+    RESULT_STORE_MAX_RESULTS = 20  # Clustering results kept server-side for pagination
+    CLUSTER_CACHE_DIR = "./cache/clusters"  # Memoised clustering results (labels, previews)
+    CLUSTER_CACHE_MAX_ENTRIES = 50
+    CLUSTER_CACHE_MAX_BYTES = 256 * 1024 * 1024
     MAX_UPLOAD_SIZE = 16 * 1024 * 1024  # 16MB
 
     # Cache Settings (personnalisables)
     AUTO_CLEANUP = True                        # Nettoyage automatique des entrées invalides
-    CACHE_MAX_SIZE = 10000                     # Limite du nombre d'entrées
+    CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', 10000))                # Limite du nombre d'entrées
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 512 * 1024 * 1024))  # Budget mémoire des embeddings
+    CACHE_EVICTION_POLICY = 'lru'              # 'lru' ou 'directory' (dossier le moins récemment regroupé)
+    CACHE_EVICTION_TARGET = 0.9                # Éviction jusqu'à 90% des limites
+    CACHE_CLEANUP_BATCH_SIZE = 100             # Dossiers vérifiés par lot lors du nettoyage
     
     # Migration Settings
     LEGACY_CACHE_FILE = "save_emb_keypath.json"  # Ancien fichier à migrer
     BACKUP_ON_MIGRATE = True                     # Sauvegarde avant migration
+    MIGRATION_BATCH_SIZE = 1000                  # Images insérées par lot lors de l'import
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -49,15 +49,26 @@ def index():
 
 @bp.route('/health')
 def health_check():
-    """Point de contrôle de santé de l'application"""
+    """Point de contrôle de santé de l'application (liveness)"""
+    from app.api.routes import services_readiness
+    
     return {
         'status': 'healthy',
         'version': '2.0',
+        'readiness': services_readiness(),
         'templates_folder': current_app.template_folder,
         'static_folder': current_app.static_folder,
         'template_exists': os.path.exists(os.path.join(current_app.template_folder, 'index.html'))
     }
 
+@bp.route('/health/ready')
+def readiness_check():
+    """Readiness: 200 once the model and the embedding cache are loaded, 503 before"""
+    from app.api.routes import services_readiness
+    
+    readiness = services_readiness()
+    return readiness, 200 if readiness['ready'] else 503
+
 @bp.route('/static/<path:filename>')
 def static_files(filename):
     """Serve static files"""
@@ -0,0 +1,163 @@
+"""Adaptive multi-resolution face detection.
+
+Detection first runs on a small proxy of the image. Only faces the proxy pass
+reports as small or low-confidence are re-examined, in regions of a
+higher-resolution copy (decoded only then); too many such regions (group
+photos) re-examine the whole image at high resolution. Boxes are returned in
+the reference space (image downscaled to MAX_IMAGE_SIZE) used by
+ImageProcessor.crop_face.
+
+The proxy has to look for faces as small as the reference pass does, so its
+detector pyramid costs about as much as a single MAX_IMAGE_SIZE pass: this
+trades extra compute for high-resolution crops of small faces, and is off by
+default (ADAPTIVE_DETECTION).
+"""
+import logging
+from typing import List, Dict, Tuple, Callable, Optional
+import numpy as np
+from app.config import Config
+from app.services.inference import crop_detection
+
+logger = logging.getLogger(__name__)
+
+# detect(image, threshold, min_face_size in image pixels or None for the default)
+DetectFn = Callable[[np.ndarray, float, Optional[int]], List[Dict]]
+# Decodes the image again at ADAPTIVE_MAX_SIZE (None on failure)
+LoadFn = Callable[[], Optional[np.ndarray]]
+
+def _downscale(image: np.ndarray, max_size: int) -> Tuple[np.ndarray, float]:
+    """Image with its longest side at most max_size, and the scale applied"""
+    from app.utils.image_processor import ImageProcessor
+
+    height, width = image.shape[:2]
+    if max(height, width) <= max_size:
+        return image, 1.0
+    resized = ImageProcessor.resize_image(image, max_size)
+    return resized, resized.shape[1] / width
+
+def _map_detection(detection: Dict, offset: Tuple[float, float], factor: float) -> Dict:
+    """Translate by offset then scale a detection's box and keypoints"""
+    x, y, w, h = detection['box']
+    ox, oy = offset
+    mapped = dict(detection)
+    mapped['box'] = [
+        int(round((x + ox) * factor)), int(round((y + oy) * factor)),
+        max(1, int(round(w * factor))), max(1, int(round(h * factor)))
+    ]
+    mapped['keypoints'] = {
+        name: (float((px + ox) * factor), float((py + oy) * factor))
+        for name, (px, py) in (detection.get('keypoints') or {}).items()
+    }
+    return mapped
+
+def _regions(boxes: np.ndarray, shape: Tuple[int, int], margin: float) -> List[List[float]]:
+    """Square regions around boxes (x, y, w, h), clipped to the image and merged when overlapping"""
+    height, width = shape
+    centers = boxes[:, :2] + boxes[:, 2:] / 2
+    halves = boxes[:, 2:].max(axis=1) * (0.5 + margin)
+    regions = np.column_stack([
+        np.clip(centers[:, 0] - halves, 0, width), np.clip(centers[:, 1] - halves, 0, height),
+        np.clip(centers[:, 0] + halves, 0, width), np.clip(centers[:, 1] + halves, 0, height)
+    ]).tolist()
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+def _suppress_duplicates(detections: List[Dict], iou_threshold: float = 0.4) -> List[int]:
+    """Indices of the most confident detection among overlapping boxes"""
+    if len(detections) < 2:
+        return list(range(len(detections)))
+    boxes = np.array([d['box'] for d in detections], dtype=np.float32)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    inter_w = np.clip(np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1), 0, None)
+    inter_h = np.clip(np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1), 0, None)
+    inter = inter_w * inter_h
+    iou = inter / (areas[:, None] + areas - inter + 1e-6)
+
+    keep = []
+    for i in np.argsort([-d['confidence'] for d in detections], kind='stable'):
+        if all(iou[i, j] <= iou_threshold for j in keep):
+            keep.append(i)
+    return sorted(keep)
+
+def _high_resolution(image: np.ndarray, load_high: Optional[LoadFn]) -> Tuple[np.ndarray, float]:
+    """ADAPTIVE_MAX_SIZE copy of the image and its scale relative to image
+
+    The file is only decoded again when image is smaller than ADAPTIVE_MAX_SIZE.
+    """
+    source = image
+    if load_high is not None and max(image.shape[:2]) < Config.ADAPTIVE_MAX_SIZE:
+        loaded = load_high()
+        if loaded is not None and loaded.shape[1] > image.shape[1]:
+            source = loaded
+    high, _ = _downscale(source, Config.ADAPTIVE_MAX_SIZE)
+    return high, high.shape[1] / image.shape[1]
+
+def detect_adaptive(image: np.ndarray, detect: DetectFn,
+                    load_high: Optional[LoadFn] = None) -> Tuple[List[Dict], List[np.ndarray]]:
+    """Detect faces coarse-to-fine
+
+    image needs at least MAX_IMAGE_SIZE on its longest side when available;
+    load_high decodes the image at ADAPTIVE_MAX_SIZE and is only called when
+    faces are re-examined. Returns detections in the reference (MAX_IMAGE_SIZE)
+    space and, for each, a face crop for embedding: confident faces are cropped
+    from image, re-examined ones from the high-resolution copy.
+    """
+    threshold = Config.FACE_DETECTION_THRESHOLD
+    proxy, proxy_scale = _downscale(image, Config.ADAPTIVE_PROXY_SIZE)
+    ref_scale = min(1.0, Config.MAX_IMAGE_SIZE / max(image.shape[:2]))
+
+    # The proxy must see faces as small as the reference pass does (MTCNN_MIN_FACE_SIZE
+    # at MAX_IMAGE_SIZE), otherwise small faces never become candidates
+    proxy_min_face = max(1, int(Config.MTCNN_MIN_FACE_SIZE * proxy_scale / ref_scale))
+    candidates = detect(proxy, Config.ADAPTIVE_CANDIDATE_THRESHOLD, proxy_min_face)
+    accepted, uncertain = [], []
+    for detection in candidates:
+        size = min(detection['box'][2], detection['box'][3])
+        if detection['confidence'] >= threshold and size >= Config.ADAPTIVE_MIN_FACE_SIZE:
+            accepted.append(detection)
+        else:
+            uncertain.append(detection)
+
+    # (detection, image it was found in, scale of that image relative to image)
+    found = [(_map_detection(d, (0, 0), 1.0 / proxy_scale), image, 1.0) for d in accepted]
+
+    if uncertain:
+        high, high_scale = _high_resolution(image, load_high)
+        to_high = high_scale / proxy_scale
+        if len(uncertain) <= Config.ADAPTIVE_MAX_REGIONS:
+            boxes = np.array([d['box'] for d in uncertain], dtype=np.float32)
+            for x1, y1, x2, y2 in _regions(boxes, proxy.shape[:2], Config.ADAPTIVE_REGION_MARGIN):
+                hx1, hy1 = int(x1 * to_high), int(y1 * to_high)
+                hx2, hy2 = int(np.ceil(x2 * to_high)), int(np.ceil(y2 * to_high))
+                region = high[hy1:hy2, hx1:hx2]
+                found.extend(
+                    (_map_detection(d, (hx1, hy1), 1.0), high, high_scale)
+                    for d in detect(region, threshold, None)
+                )
+        else:
+            # Many small faces (group photo): re-examine the whole image at high resolution
+            found = [(d, high, high_scale) for d in detect(high, threshold, None)]
+    elif not accepted and Config.ADAPTIVE_RESCAN_EMPTY:
+        # Nothing found on the proxy: fall back to the reference resolution
+        reference, _ = _downscale(image, Config.MAX_IMAGE_SIZE)
+        found = [(d, reference, ref_scale) for d in detect(reference, threshold, None)]
+
+    detections = [_map_detection(d, (0, 0), ref_scale / scale) for d, _, scale in found]
+    keep = _suppress_duplicates(detections)
+    return [detections[i] for i in keep], [crop_detection(found[i][1], found[i][0]['box']) for i in keep]
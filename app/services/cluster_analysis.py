@@ -0,0 +1,117 @@
+"""Post-clustering analysis with blocked NumPy operations.
+
+For every cluster: centroid of the L2-normalised embeddings, medoid, the most
+representative faces (closest to the centroid, used as previews), a cohesion
+score (mean cosine similarity to the centroid) and the nearest other clusters
+by centroid similarity, as merge candidates. Under cosine similarity the member
+closest to the centroid direction maximises the summed similarity to the other
+members, so the medoid needs no pairwise matrix.
+
+Centroids are computed once for the whole result (one sparse product); the
+per-cluster summaries only need the members of the clusters being shown, so
+they are built page by page. The result-wide figures (mean cohesion, merge
+suggestions) cover every cluster and are meant to be computed once, off the
+request path.
+"""
+from typing import Dict, List, Tuple
+import numpy as np
+from app.config import Config
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def cluster_centroids(embeddings: np.ndarray, labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted cluster ids (noise excluded) and their unit centroids"""
+    from scipy.sparse import csr_matrix
+
+    labels = np.asarray(labels, dtype=np.int64)
+    rows = np.flatnonzero(labels != -1)
+    cluster_ids, group = np.unique(labels[rows], return_inverse=True)
+    if not len(cluster_ids):
+        return cluster_ids, np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+
+    # Sum of normalised embeddings per cluster, without copying the embedding matrix
+    norms = np.sqrt(np.einsum('ij,ij->i', embeddings, embeddings))[rows]
+    weights = csr_matrix((1.0 / np.maximum(norms, 1e-12), (group, rows)),
+                         shape=(len(cluster_ids), len(labels)), dtype=np.float32)
+    return cluster_ids, _normalise(np.asarray(weights @ embeddings, dtype=np.float32))
+
+def nearest_clusters(centroids: np.ndarray, rows: np.ndarray, top_k: int = None,
+                     block_size: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k most similar other centroids of the given centroid rows, by blocks of rows"""
+    top_k = Config.CLUSTER_MERGE_TOP_K if top_k is None else top_k
+    block_size = block_size or Config.CLUSTER_ANALYSIS_BLOCK_SIZE
+
+    rows = np.asarray(rows, dtype=np.int64)
+    k = max(min(top_k, len(centroids) - 1), 0)
+    neighbours = np.zeros((len(rows), k), dtype=np.int64)
+    similarities = np.zeros((len(rows), k), dtype=np.float32)
+    if k == 0:
+        return neighbours, similarities
+
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block = centroids[block_rows] @ centroids.T
+        block[np.arange(len(block_rows)), block_rows] = -np.inf  # not its own candidate
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        values = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-values, axis=1)
+        neighbours[start:start + len(block_rows)] = np.take_along_axis(top, order, axis=1)
+        similarities[start:start + len(block_rows)] = np.take_along_axis(values, order, axis=1)
+    return neighbours, similarities
+
+def summarise_members(embeddings: np.ndarray, members: np.ndarray, centroid: np.ndarray,
+                      max_representatives: int = None) -> Dict:
+    """Medoid, representative rows (closest first) and cohesion of one cluster"""
+    max_representatives = max_representatives or Config.MAX_FACES_PER_CLUSTER
+    similarity = _normalise(np.asarray(embeddings[members], dtype=np.float32)) @ centroid
+    ranked = members[np.argsort(-similarity, kind='stable')]
+    return {
+        'medoid': int(ranked[0]),
+        'representatives': ranked[:max_representatives],
+        'cohesion': float(similarity.mean())
+    }
+
+def mean_cohesion(embeddings: np.ndarray, labels: np.ndarray, cluster_ids: np.ndarray,
+                  centroids: np.ndarray, block_size: int = None) -> float:
+    """Mean over clusters of the cosine similarity of members to their centroid"""
+    block_size = (block_size or Config.CLUSTER_ANALYSIS_BLOCK_SIZE) * 8
+    if not len(cluster_ids):
+        return 0.0
+    labels = np.asarray(labels, dtype=np.int64)
+    rows = np.flatnonzero(labels != -1)
+    group = np.searchsorted(cluster_ids, labels[rows])
+    similarity = np.empty(len(rows), dtype=np.float64)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        similarity[start:start + block_size] = np.einsum(
+            'ij,ij->i', _normalise(np.asarray(embeddings[block], dtype=np.float32)),
+            centroids[group[start:start + block_size]]
+        )
+    cohesion = np.bincount(group, weights=similarity) / np.bincount(group)
+    return float(cohesion.mean())
+
+def merge_suggestions(cluster_ids: np.ndarray, centroids: np.ndarray,
+                      min_similarity: float = None, limit: int = None) -> List[Dict]:
+    """Most similar cluster pairs across the result, each pair reported once"""
+    min_similarity = Config.CLUSTER_MERGE_MIN_SIMILARITY if min_similarity is None else min_similarity
+    limit = limit or Config.CLUSTER_MERGE_MAX_SUGGESTIONS
+
+    neighbours, similarity = nearest_clusters(centroids, np.arange(len(centroids)))
+    sources = np.repeat(np.arange(len(neighbours)), neighbours.shape[1])
+    targets, values = neighbours.ravel(), similarity.ravel()
+    keep = values >= min_similarity
+    # A pair may only be in one direction's top-k: order each pair (low, high)
+    pairs = np.sort(np.column_stack([sources[keep], targets[keep]]), axis=1)
+    values = values[keep]
+    if not len(pairs):
+        return []
+    pairs, unique = np.unique(pairs, axis=0, return_index=True)
+    values = values[unique]
+
+    best = np.argsort(-values, kind='stable')[:limit]
+    return [
+        {'clusters': cluster_ids[pairs[i]].tolist(), 'similarity': float(values[i])}
+        for i in best
+    ]
@@ -0,0 +1,178 @@
+"""On-disk memo of clustering results.
+
+Results are keyed by the fingerprint of the clustered DetectionSet, the
+algorithm and its normalised parameters, so an identical request is answered
+without running scikit-learn, and any change in the detections (re-extraction,
+different image selection) misses the cache. Each entry is written once as an
+.npz file (labels in the DetectionSet's canonical row order, statistics); the
+preview faces cropped page by page are appended to a .jsonl file next to it,
+so paging through a result writes each crop once. Entries are evicted least
+recently used first, and entries larger than the byte budget are not kept.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+def normalise_parameters(params: Dict) -> Dict:
+    """Parameters with numeric values in canonical form (eps=0.5 and eps=0.50 match)"""
+    normalised = {}
+    for name, value in sorted(params.items()):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, float):
+            value = round(value, 6)
+        normalised[name] = value
+    return normalised
+
+def result_key(fingerprint: str, algorithm: str, params: Dict) -> str:
+    payload = json.dumps([fingerprint, algorithm.lower(), normalise_parameters(params)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+class ClusterCache:
+    """Bounded directory of clustering results, least recently used evicted first
+
+    The index is shared by all threads of a process; entries written by other
+    processes (web workers) are picked up from the directory on lookup.
+    """
+
+    def __init__(self, cache_dir: str = None, max_entries: int = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or Config.CLUSTER_CACHE_DIR
+        self.max_entries = max_entries or Config.CLUSTER_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or Config.CLUSTER_CACHE_MAX_BYTES
+        self._index: Optional['OrderedDict[str, int]'] = None  # key -> bytes on disk
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _records_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jsonl")
+
+    def _size_on_disk(self, key: str) -> int:
+        size = 0
+        for path in (self._path(key), self._records_path(key)):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _ensure_index(self) -> 'OrderedDict[str, int]':
+        """Entries on disk, least recently used first (file mtime)"""
+        if self._index is None:
+            entries = []
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith('.npz'):
+                        key = entry.name[:-4]
+                        entries.append((entry.stat().st_mtime, key, self._size_on_disk(key)))
+            self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        return self._index
+
+    def _lookup(self, key: str) -> bool:
+        """Whether the entry exists, indexing it if another process wrote it"""
+        index = self._ensure_index()
+        if key not in index:
+            if not os.path.exists(self._path(key)):
+                return False
+            index[key] = self._size_on_disk(key)
+        return True
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, Dict, List[Dict]]]:
+        """(canonical labels, metadata, appended records) of a cached result, or None"""
+        with self._lock:
+            if not self._lookup(key):
+                return None
+            try:
+                with np.load(self._path(key)) as data:
+                    labels = data['labels']
+                    metadata = json.loads(str(data['metadata']))
+                records = []
+                if os.path.exists(self._records_path(key)):
+                    with open(self._records_path(key), 'r', encoding='utf-8') as f:
+                        for line in f:
+                            try:
+                                records.append(json.loads(line))
+                            except ValueError:
+                                pass  # Line cut short by an interrupted append
+                os.utime(self._path(key))
+                self._index.move_to_end(key)
+                return labels, metadata, records
+            except Exception as e:
+                logger.warning(f"Dropping unreadable clustering cache entry {key}: {e}")
+                self._remove(key)
+                return None
+
+    def put(self, key: str, labels: np.ndarray, metadata: Dict) -> bool:
+        """Write a new entry; False when it does not fit in the byte budget"""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, labels=np.asarray(labels, dtype=np.int64),
+                             metadata=np.array(json.dumps(metadata)))
+                os.replace(tmp_path, path)
+                # A previous entry with the same key may have left crops behind
+                if os.path.exists(self._records_path(key)):
+                    os.remove(self._records_path(key))
+            except Exception as e:
+                logger.error(f"Error saving clustering result {key}: {e}")
+                return False
+            self._ensure_index()[key] = self._size_on_disk(key)
+            self._index.move_to_end(key)
+            return self._enforce_limits(key)
+
+    def append(self, key: str, records: List[Dict]) -> bool:
+        """Append records (e.g. newly cropped faces) to an entry; False if it was dropped"""
+        with self._lock:
+            if not self._lookup(key):
+                return False
+            try:
+                with open(self._records_path(key), 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(record) + '\n' for record in records))
+            except Exception as e:
+                logger.error(f"Error saving clustering result {key}: {e}")
+                return False
+            self._index[key] = self._size_on_disk(key)
+            self._index.move_to_end(key)
+            return self._enforce_limits(key)
+
+    def _enforce_limits(self, key: str) -> bool:
+        """Evict least recently used entries; drop key itself if it alone exceeds the budget"""
+        index = self._index
+        # Other workers may have grown or evicted entries: refresh sizes from disk
+        for other in list(index):
+            if other != key and not os.path.exists(self._path(other)):
+                del index[other]
+            else:
+                index[other] = self._size_on_disk(other)
+
+        if index.get(key, 0) > self.max_bytes:
+            logger.info(f"Clustering result {key} exceeds CLUSTER_CACHE_MAX_BYTES, not cached")
+            self._remove(key)
+            return False
+
+        total_bytes = sum(index.values())
+        while len(index) > self.max_entries or total_bytes > self.max_bytes:
+            oldest = next(k for k in index if k != key)
+            total_bytes -= index[oldest]
+            self._remove(oldest)
+        return True
+
+    def _remove(self, key: str) -> None:
+        self._index.pop(key, None)
+        for path in (self._path(key), self._records_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,266 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Iterator, Optional
+import numpy as np
+from app.config import Config
+from app.services.cluster_analysis import (
+    cluster_centroids, nearest_clusters, summarise_members, mean_cohesion, merge_suggestions
+)
+from app.utils.detection_set import DetectionSet, group_indices
+
+logger = logging.getLogger(__name__)
+
+class ClusterResult:
+    """Clustering output kept server-side and organised on demand, page by page"""
+
+    def __init__(self, detections: DetectionSet, labels: np.ndarray,
+                 statistics: Dict, algorithm: str, parameters: Dict,
+                 cache_key: Optional[str] = None, records: Optional[List[Dict]] = None):
+        self.result_id = uuid.uuid4().hex
+        self.detections = detections
+        self.statistics = statistics
+        self.algorithm = algorithm
+        self.parameters = parameters
+        self.cache_key = cache_key
+
+        # Vectorised group-by: member indices per cluster, clusters sorted by size
+        labels = np.asarray(labels, dtype=np.int64)
+        self.labels = labels
+        clustered = np.flatnonzero(labels != -1)
+        cluster_ids, groups = group_indices(labels[clustered])
+        counts = np.array([len(g) for g in groups], dtype=np.int64)
+        by_size = np.argsort(-counts, kind='stable')
+        self.cluster_ids: List[int] = cluster_ids[by_size].tolist()
+        self.members: Dict[int, np.ndarray] = {
+            int(cluster_ids[i]): clustered[groups[i]] for i in by_size
+        }
+
+        self._centroids = None  # (sorted cluster ids, unit centroids), computed on first need
+        self._summaries: Dict[int, Dict] = {}  # Medoid, representatives, cohesion, merge candidates
+        self._faces: Dict[int, List[str]] = {}
+        self._analysis: Optional[Dict] = None  # Mean cohesion and merge suggestions
+        self._analysis_job: Optional[Future] = None
+        self._unsaved: List[int] = []  # Clusters summarised since the last cache write
+        self._analysis_unsaved = False
+        self._lock = threading.Lock()
+        for record in records or []:
+            self._restore(record)
+
+    @property
+    def total_clusters(self) -> int:
+        return len(self.cluster_ids)
+
+    def _canonical_rank(self) -> np.ndarray:
+        """Position of each row in the DetectionSet's canonical order"""
+        order = self.detections.canonical_order()
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        return rank
+
+    def _restore(self, record: Dict) -> None:
+        """Load a cache record; row positions are stored in canonical order"""
+        if 'analysis' in record:
+            self._analysis = record['analysis']
+        elif 'summary' in record and int(record['cluster']) in self.members:
+            order = self.detections.canonical_order()
+            summary = dict(record['summary'])
+            summary['medoid'] = int(order[summary['medoid']])
+            summary['representatives'] = order[np.asarray(summary['representatives'], dtype=np.int64)]
+            self._summaries[int(record['cluster'])] = summary
+            self._faces[int(record['cluster'])] = record['faces']
+
+    def cache_metadata(self) -> Dict:
+        """JSON part of the clustering cache entry, written once"""
+        return {
+            'statistics': self.statistics,
+            'algorithm': self.algorithm,
+            'parameters': self.parameters
+        }
+
+    def unsaved_records(self) -> List[Dict]:
+        """Cache records of what was computed since the last call (summaries, crops, analysis)"""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, []
+            analysis_unsaved, self._analysis_unsaved = self._analysis_unsaved, False
+        if not unsaved and not analysis_unsaved:
+            return []
+
+        records = []
+        if unsaved:
+            rank = self._canonical_rank()
+            for cid in unsaved:
+                summary = dict(self._summaries[cid])
+                summary['medoid'] = int(rank[summary['medoid']])
+                summary['representatives'] = rank[summary['representatives']].tolist()
+                records.append({'cluster': cid, 'faces': self._faces[cid], 'summary': summary})
+        if analysis_unsaved:
+            records.append({'analysis': self._analysis})
+        return records
+
+    def _get_centroids(self):
+        with self._lock:
+            if self._centroids is None:
+                self._centroids = cluster_centroids(self.detections.embeddings, self.labels)
+            return self._centroids
+
+    def _summarise(self, cluster_ids: List[int]) -> None:
+        """Summaries of the given clusters that do not have one yet"""
+        with self._lock:
+            missing = [cid for cid in cluster_ids if cid not in self._summaries]
+        if not missing:
+            return
+
+        sorted_ids, centroids = self._get_centroids()
+        rows = np.searchsorted(sorted_ids, missing)
+        neighbours, similarities = nearest_clusters(centroids, rows)
+        summaries = {}
+        for cid, row, near, similarity in zip(missing, rows, neighbours, similarities):
+            summary = summarise_members(self.detections.embeddings, self.members[cid], centroids[row])
+            summary['merge_candidates'] = [
+                {'id': int(sorted_ids[j]), 'similarity': float(s)}
+                for j, s in zip(near, similarity)
+                if s >= Config.CLUSTER_MERGE_MIN_SIMILARITY
+            ]
+            summaries[cid] = summary
+        with self._lock:
+            for cid, summary in summaries.items():
+                self._summaries.setdefault(cid, summary)
+
+    def _analyse(self) -> Dict:
+        sorted_ids, centroids = self._get_centroids()
+        analysis = {
+            'mean_cohesion': mean_cohesion(self.detections.embeddings, self.labels, sorted_ids, centroids),
+            'merge_suggestions': merge_suggestions(sorted_ids, centroids)
+        }
+        with self._lock:
+            self._analysis = analysis
+            self._analysis_unsaved = True
+        return analysis
+
+    def start_analysis(self, executor: ThreadPoolExecutor) -> Optional[Future]:
+        """Compute the result-wide analysis once; the background job, if one was started
+
+        Results of up to CLUSTER_ANALYSIS_SYNC_MAX_CLUSTERS clusters are analysed
+        right away (a fraction of a second), larger ones on the executor.
+        """
+        with self._lock:
+            if self._analysis is not None or self._analysis_job is not None:
+                return None
+            if self.total_clusters > Config.CLUSTER_ANALYSIS_SYNC_MAX_CLUSTERS:
+                self._analysis_job = executor.submit(self._analyse)
+                return self._analysis_job
+        self._analyse()
+        return None
+
+    def summary(self, wait: bool = False) -> Dict:
+        """Result-wide analysis; values are None while it is still being computed"""
+        job = self._analysis_job
+        if wait and self._analysis is None and job is not None:
+            job.result()
+        analysis = self._analysis
+        if analysis is None:
+            return {'ready': False, 'mean_cohesion': None, 'merge_suggestions': None}
+        return {'ready': True, **analysis}
+
+    def _crop_faces(self, cluster_ids: List[int], executor: ThreadPoolExecutor) -> None:
+        """Summarise and crop preview faces for clusters that do not have them yet, in parallel"""
+        from app.utils.image_processor import ImageProcessor
+
+        with self._lock:
+            missing = [cid for cid in cluster_ids if cid not in self._faces]
+        if not missing:
+            return
+        self._summarise(missing)
+
+        jobs = []
+        for cid in missing:
+            for index in self._summaries[cid]['representatives']:
+                jobs.append((cid, executor.submit(
+                    ImageProcessor.crop_face, self.detections.path_of(index),
+                    self.detections.boxes[index].tolist()
+                )))
+
+        faces = {cid: [] for cid in missing}
+        for cid, job in jobs:
+            try:
+                face_image, success = job.result()
+                if success:
+                    faces[cid].append(face_image)
+            except Exception as e:
+                logger.warning(f"Error cropping face for cluster {cid}: {e}")
+
+        with self._lock:
+            new = [cid for cid in missing if cid not in self._faces]
+            self._faces.update(faces)
+            self._unsaved.extend(new)
+
+    def _cluster_view(self, cluster_id: int) -> Dict:
+        members = self.members[cluster_id]
+        summary = self._summaries[cluster_id]
+        medoid = summary['medoid']
+        return {
+            'id': cluster_id,
+            'count': int(len(members)),
+            'paths': [self.detections.path_of(i) for i in members],
+            'faces': self._faces.get(cluster_id, []),
+            'cohesion': summary['cohesion'],
+            'medoid': {
+                'path': self.detections.path_of(medoid),
+                'box': self.detections.boxes[medoid].tolist()
+            },
+            'merge_candidates': summary['merge_candidates']
+        }
+
+    def page(self, page: int, per_page: int, executor: ThreadPoolExecutor) -> Dict:
+        """Clusters of one page (largest first) with their preview faces"""
+        page = max(1, page)
+        per_page = max(1, min(per_page, Config.PAGINATION_MAX_PER_PAGE))
+        start = (page - 1) * per_page
+        cluster_ids = self.cluster_ids[start:start + per_page]
+
+        self._crop_faces(cluster_ids, executor)
+        total_pages = (self.total_clusters + per_page - 1) // per_page
+        return {
+            'clusters': [self._cluster_view(cid) for cid in cluster_ids],
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total_clusters': self.total_clusters,
+                'total_pages': total_pages,
+                'has_next': page < total_pages
+            }
+        }
+
+    def iter_clusters(self, executor: ThreadPoolExecutor, chunk_size: int = None) -> Iterator[Dict]:
+        """Yield clusters (largest first) as soon as each chunk is organised"""
+        chunk_size = chunk_size or Config.CHUNK_SIZE
+        for start in range(0, self.total_clusters, chunk_size):
+            cluster_ids = self.cluster_ids[start:start + chunk_size]
+            self._crop_faces(cluster_ids, executor)
+            for cid in cluster_ids:
+                yield self._cluster_view(cid)
+
+class ClusterResultStore:
+    """Bounded in-memory store of clustering results, oldest evicted first"""
+
+    def __init__(self, max_results: int = None):
+        self.max_results = max_results or Config.RESULT_STORE_MAX_RESULTS
+        self._results: 'OrderedDict[str, ClusterResult]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, result: ClusterResult) -> str:
+        with self._lock:
+            self._results[result.result_id] = result
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return result.result_id
+
+    def get(self, result_id: str) -> Optional[ClusterResult]:
+        with self._lock:
+            result = self._results.get(result_id)
+            if result is not None:
+                self._results.move_to_end(result_id)
+            return result
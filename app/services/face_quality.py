@@ -0,0 +1,88 @@
+"""Cheap face quality scoring, applied between detection and embedding.
+
+Faces that are too small, too far from frontal (keypoint geometry) or too
+blurry (variance of the Laplacian) are rejected before inference.
+"""
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+from app.config import Config
+from app.utils.detection_set import KEYPOINT_NAMES
+
+# Faces are compared for sharpness at a fixed size
+SHARPNESS_SIZE = 64
+
+def _keypoints_array(detections: List[Dict]) -> np.ndarray:
+    keypoints = np.zeros((len(detections), len(KEYPOINT_NAMES), 2), dtype=np.float32)
+    for i, detection in enumerate(detections):
+        points = detection.get('keypoints') or {}
+        for k, name in enumerate(KEYPOINT_NAMES):
+            if name in points:
+                keypoints[i, k] = points[name]
+    return keypoints
+
+def sharpness(faces: List[np.ndarray]) -> np.ndarray:
+    """Variance of the Laplacian of each face, resized to SHARPNESS_SIZE grayscale"""
+    import cv2
+
+    size = (SHARPNESS_SIZE, SHARPNESS_SIZE)
+    stack = np.zeros((len(faces), SHARPNESS_SIZE, SHARPNESS_SIZE), dtype=np.float32)
+    for i, face in enumerate(faces):
+        if face.size == 0:
+            continue
+        gray = face[..., :3].mean(axis=-1) if face.ndim == 3 else face
+        stack[i] = cv2.resize(gray.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+
+    laplacian = (stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2]
+                 + stack[:, 1:-1, 2:] - 4 * stack[:, 1:-1, 1:-1])
+    return laplacian.reshape(len(faces), -1).var(axis=1)
+
+def _resolution(boxes: np.ndarray, faces: List[np.ndarray]) -> np.ndarray:
+    """Pixels of each face crop per reference pixel (above 1 for high-resolution crops)"""
+    resolution = np.ones(len(boxes), dtype=np.float32)
+    for i, face in enumerate(faces):
+        height, width = face.shape[:2]
+        # A box clipped by the image border is cropped smaller on one side only
+        resolution[i] = max(width / max(boxes[i, 2], 1), height / max(boxes[i, 3], 1), 1e-6)
+    return resolution
+
+def score_faces(detections: List[Dict], faces: List[np.ndarray]) -> Dict[str, np.ndarray]:
+    """Size, yaw and sharpness of each detection (boxes in the reference space)
+
+    The size is the shortest box side in pixels of the image the face is
+    cropped from, so faces found by a high-resolution pass (adaptive
+    detection) are judged on the detail they actually have.
+    """
+    boxes = np.array([d['box'] for d in detections], dtype=np.float32).reshape(-1, 4)
+    keypoints = _keypoints_array(detections)
+
+    left_eye, right_eye, nose = keypoints[:, 0], keypoints[:, 1], keypoints[:, 2]
+    eye_distance = np.linalg.norm(right_eye - left_eye, axis=1)
+    eyes_center = (left_eye + right_eye) / 2
+    # Nose offset from the eyes' midpoint, relative to the eye distance (0 = frontal)
+    yaw = np.where(
+        eye_distance > 0,
+        np.abs(nose[:, 0] - eyes_center[:, 0]) / np.maximum(eye_distance, 1e-6),
+        0.0
+    )
+
+    return {
+        'size': boxes[:, 2:].min(axis=1) * (_resolution(boxes, faces) if faces else 1.0),
+        'yaw': yaw,
+        'sharpness': sharpness(faces) if faces else np.zeros(0, dtype=np.float32)
+    }
+
+def assess_faces(detections: List[Dict], faces: List[np.ndarray]) -> Tuple[np.ndarray, List[Optional[str]]]:
+    """Keep mask and rejection reason (None when kept) for each detection"""
+    if not detections:
+        return np.zeros(0, dtype=bool), []
+
+    scores = score_faces(detections, faces)
+    too_small = scores['size'] < Config.QUALITY_MIN_FACE_SIZE
+    profile = scores['yaw'] > Config.QUALITY_MAX_YAW
+    blurry = scores['sharpness'] < Config.QUALITY_MIN_SHARPNESS
+
+    reasons: List[Optional[str]] = [None] * len(detections)
+    for reason, mask in (('blurry', blurry), ('profile', profile), ('too_small', too_small)):
+        for i in np.flatnonzero(mask):
+            reasons[i] = reason
+    return ~(too_small | profile | blurry), reasons
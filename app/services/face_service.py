@@ -1,23 +1,146 @@
 import asyncio
 import logging
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
 import numpy as np
-from keras_facenet import FaceNet
-from sklearn.cluster import DBSCAN, AgglomerativeClustering, KMeans
 from app.config import Config
+from app.services.adaptive_detection import detect_adaptive
+from app.services.face_quality import assess_faces
+from app.services.inference import LocalInference, crop_detection
+from app.utils.detection_set import DetectionSet
+from app.utils.perceptual_hash import PerceptualHashIndex, dhash
+from app.services.model_server import ModelClient, ModelServerUnavailable, ModelServerError
 
 logger = logging.getLogger(__name__)
 
 class FaceDetectionService:
     """Service for face detection and embedding generation"""
     
-    def __init__(self):
-        self.embedder = FaceNet()
+    def __init__(self, model_socket: Optional[str] = None, embedding_cache=None):
+        # FaceNet (and TensorFlow) are only loaded on first use or by load_model()
+        self.local = LocalInference()
+        socket_path = model_socket or Config.MODEL_SERVER_SOCKET
+        self.remote = ModelClient(socket_path) if socket_path else None
+        self._remote_checked_at: Optional[float] = None
+        self._remote_available = False
         self.executor = ThreadPoolExecutor(max_workers=Config.MAX_WORKERS)
+        # Near-duplicate images (bursts, re-exports) reuse earlier detections: the
+        # index only keeps the source path, its detections are read back from the
+        # embedding cache, or from the extraction in progress before they reach it
+        self.hash_index = PerceptualHashIndex(Config.PHASH_MAX_DISTANCE, Config.PHASH_INDEX_MAX_ENTRIES)
+        self.embedding_cache = embedding_cache
+        self._in_flight: Dict[str, Tuple[DetectionSet, Dict]] = {}
+        self._in_flight_lock = threading.Lock()
     
-    async def detect_faces_async(self, image_paths: List[str]) -> List[Dict]:
-        """Asynchronously detect faces in multiple images"""
+    @property
+    def embedder(self):
+        """In-process FaceNet model, loaded on first access"""
+        return self.local.embedder
+    
+    @property
+    def load_error(self) -> Optional[str]:
+        return self.local.load_error
+    
+    @property
+    def is_ready(self) -> bool:
+        """Whether inference can start immediately (shared server or local model)
+        
+        Uses the last known model server state: the server is only pinged on
+        the inference path, so health checks never wait on the socket.
+        """
+        return (self.remote is not None and self._remote_available) or self.local.is_ready
+    
+    def load_model(self) -> None:
+        """Load the in-process model, unless a model server is serving it"""
+        if not self._use_remote():
+            self.local.load()
+    
+    def _use_remote(self) -> bool:
+        """Check (at most every MODEL_SERVER_RETRY_INTERVAL seconds) the model server"""
+        if self.remote is None:
+            return False
+        now = time.monotonic()
+        if (self._remote_checked_at is None
+                or now - self._remote_checked_at >= Config.MODEL_SERVER_RETRY_INTERVAL):
+            self._remote_checked_at = now
+            try:
+                self._remote_available = bool(self.remote.ping().get('ready'))
+            except (ModelServerUnavailable, ModelServerError):
+                self._remote_available = False
+            if not self._remote_available:
+                logger.warning("Model server unavailable, using in-process inference")
+        return self._remote_available
+    
+    def _infer(self, method: str, *args):
+        """Call an inference method on the model server when available, else in-process
+        
+        Only an unreachable server falls back to the in-process model; a request
+        the server rejects (queue full, failed image) is retried and then raised,
+        so that load spikes do not load FaceNet into every web worker
+        (unless MODEL_SERVER_LOCAL_FALLBACK).
+        """
+        if self._use_remote():
+            for attempt in range(Config.MODEL_SERVER_RETRIES + 1):
+                try:
+                    return getattr(self.remote, method)(*args)
+                except ModelServerUnavailable as e:
+                    logger.warning(f"Model server lost ({e}), falling back to in-process inference")
+                    self._remote_available = False
+                    break
+                except ModelServerError as e:
+                    logger.warning(f"Model server error ({e}), attempt {attempt + 1}")
+                    if attempt < Config.MODEL_SERVER_RETRIES:
+                        time.sleep(0.1 * 2 ** attempt)
+                    elif not Config.MODEL_SERVER_LOCAL_FALLBACK:
+                        raise
+        return getattr(self.local, method)(*args)
+    
+    def _detect(self, image: np.ndarray, image_path: str) -> Tuple[List[Dict], List[np.ndarray]]:
+        """Detections in the MAX_IMAGE_SIZE reference space and their face crops"""
+        from app.utils.image_processor import ImageProcessor
+        
+        if Config.ADAPTIVE_DETECTION:
+            return detect_adaptive(
+                image,
+                lambda img, threshold, min_face_size: self._infer(
+                    'detect', img, threshold, min_face_size
+                ),
+                lambda: ImageProcessor.load_image(image_path, max_size=Config.ADAPTIVE_MAX_SIZE)
+            )
+        
+        # Resize if needed
+        if image.shape[0] > Config.MAX_IMAGE_SIZE or image.shape[1] > Config.MAX_IMAGE_SIZE:
+            image = ImageProcessor.resize_image(image, Config.MAX_IMAGE_SIZE)
+        
+        detections = self._infer('detect', image, Config.FACE_DETECTION_THRESHOLD)
+        return detections, [crop_detection(image, d['box']) for d in detections]
+    
+    def _quality_gate(self, detections: List[Dict], faces: List[np.ndarray]
+                      ) -> Tuple[List[Dict], List[np.ndarray], List[Dict]]:
+        """Split detections into kept ones (with their crops) and rejected records"""
+        if not Config.QUALITY_GATE or not detections:
+            return detections, faces, []
+        
+        keep, reasons = assess_faces(detections, faces)
+        rejected = [
+            {'box': d['box'], 'confidence': d['confidence'], 'reason': reason}
+            for d, reason in zip(detections, reasons) if reason is not None
+        ]
+        kept = np.flatnonzero(keep)
+        return [detections[i] for i in kept], [faces[i] for i in kept], rejected
+    
+    async def detect_faces_async(self, image_paths: List[str],
+                                 report: Optional[Dict] = None) -> Tuple[DetectionSet, List[str]]:
+        """Asynchronously detect faces in multiple images
+        
+        Returns the detections and the paths that were processed successfully
+        (including images without any face). When given, report is updated with
+        per-image annotations for the cache ('annotations': path -> fields such
+        as rejected faces or duplicate_of) and the rejected_faces and
+        deduplicated_images counters.
+        """
         loop = asyncio.get_event_loop()
         tasks = [
             loop.run_in_executor(self.executor, self._detect_faces_single, path)
@@ -25,63 +148,143 @@ class FaceDetectionService:
         ]
         
         results = []
+        processed = []
         for i, task in enumerate(asyncio.as_completed(tasks)):
             try:
-                detections = await task
-                results.extend(detections)
+                image_path, detections, annotations = await task
+                if detections is not None:
+                    results.append(detections)
+                    processed.append(image_path)
+                if annotations and report is not None:
+                    report.setdefault('annotations', {})[image_path] = annotations
+                    report['rejected_faces'] = (report.get('rejected_faces', 0)
+                                                + len(annotations.get('rejected', [])))
+                    if 'duplicate_of' in annotations:
+                        report['deduplicated_images'] = report.get('deduplicated_images', 0) + 1
                 if i % 10 == 0:
                     logger.info(f"Processed {i+1}/{len(image_paths)} images")
             except Exception as e:                
                 logger.error(f"Error processing image: {e}")
+        
+        # From here on the caller owns the results (and caches them)
+        with self._in_flight_lock:
+            for path in image_paths:
+                self._in_flight.pop(path, None)
                 
-        return results
+        return DetectionSet.concat(results), processed
+    
+    @staticmethod
+    def _reference_size(image: np.ndarray) -> Tuple[float, float]:
+        """Width and height of the image in the MAX_IMAGE_SIZE reference space"""
+        height, width = image.shape[:2]
+        scale = min(1.0, Config.MAX_IMAGE_SIZE / max(height, width))
+        return width * scale, height * scale
     
-    def _detect_faces_single(self, image_path: str) -> List[Dict]:
-        """Detect faces in a single image"""
+    @staticmethod
+    def _rescale(record: Dict, sx: float, sy: float) -> Dict:
+        x, y, w, h = record['box']
+        rescaled = dict(record)
+        rescaled['box'] = [int(round(x * sx)), int(round(y * sy)),
+                           max(1, int(round(w * sx))), max(1, int(round(h * sy)))]
+        if 'keypoints' in record:
+            rescaled['keypoints'] = {
+                name: (px * sx, py * sy) for name, (px, py) in record['keypoints'].items()
+            }
+        return rescaled
+    
+    def _duplicate_source(self, source_path: str) -> Optional[Tuple[DetectionSet, List[Dict]]]:
+        """Detections and rejected faces of an indexed image, if still available"""
+        with self._in_flight_lock:
+            in_flight = self._in_flight.get(source_path)
+        if in_flight is not None:
+            detections, annotations = in_flight
+            return detections, annotations.get('rejected', [])
+        if self.embedding_cache is not None:
+            entry = self.embedding_cache.get_entry(source_path)
+            if entry is not None:
+                return entry['detections'], entry.get('rejected', [])
+        return None
+    
+    def _reuse_detections(self, image_path: str, image: np.ndarray, match: Tuple
+                          ) -> Optional[Tuple[str, DetectionSet, Dict]]:
+        """Detections of a near-duplicate image, boxes rescaled to this image
+        
+        None when the source image's detections are no longer available.
+        """
+        source_path, source_size = match
+        source = self._duplicate_source(source_path)
+        if source is None:
+            return None
+        detections, rejected = source
+        width, height = self._reference_size(image)
+        sx, sy = width / source_size[0], height / source_size[1]
+        
+        annotations = {'duplicate_of': source_path}
+        if rejected:
+            annotations['rejected'] = [self._rescale(r, sx, sy) for r in rejected]
+        records = [self._rescale(d, sx, sy) for d in detections.to_records()]
+        return image_path, DetectionSet.from_records(records, image_path), annotations
+    
+    def _detect_faces_single(self, image_path: str) -> Tuple[str, Optional[DetectionSet], Dict]:
+        """Detect faces in a single image (None if the image could not be processed)"""
         from app.utils.image_processor import ImageProcessor
-        from app.utils.cache_manager import convert_numpy_types
         
         try:
-            processor = ImageProcessor()
-            image = processor.load_image(image_path)
+            image = ImageProcessor.load_image(image_path, max_size=Config.MAX_IMAGE_SIZE)
             
             if image is None:
-                return []
+                return image_path, None, {}
             
-            # Resize if needed
-            if image.shape[0] > Config.MAX_IMAGE_SIZE or image.shape[1] > Config.MAX_IMAGE_SIZE:
-                image = processor.resize_image(image, Config.MAX_IMAGE_SIZE)
+            image_hash = None
+            if Config.PHASH_DEDUP:
+                image_hash = dhash(image)
+                match = self.hash_index.find(image_hash)
+                reused = self._reuse_detections(image_path, image, match[1]) if match else None
+                if reused is not None:
+                    return reused
             
-            detections = self.embedder.extract(image, threshold=Config.FACE_DETECTION_THRESHOLD)
+            detections, faces = self._detect(image, image_path)
+            detections, faces, rejected = self._quality_gate(detections, faces)
             
-            for detection in detections:
-                detection["image_path"] = image_path
-                # Convert all numpy types to JSON-serializable types
-                detection = convert_numpy_types(detection)
+            embeddings = self._infer('embed', faces)
+            for detection, embedding in zip(detections, embeddings):
+                detection['embedding'] = embedding
             
-            return detections
+            annotations = {'rejected': rejected} if rejected else {}
+            result = DetectionSet.from_records(detections, image_path)
+            if image_hash is not None:
+                with self._in_flight_lock:
+                    self._in_flight[image_path] = (result, annotations)
+                self.hash_index.add(image_hash, (image_path, self._reference_size(image)))
+            return image_path, result, annotations
             
         except Exception as e:
             logger.error(f"Error detecting faces in {image_path}: {e}")
-            return []
+            return image_path, None, {}
 
 class ClusteringService:
     """Service for face clustering operations"""
     
     @staticmethod
     def cluster_faces(
-        detections: List[Dict], 
+        detections: DetectionSet, 
         algorithm: str = "dbscan",
+        report: Optional[Dict] = None,
         **kwargs
-    ) -> Tuple[np.ndarray, List[str]]:
-        """Cluster face embeddings using specified algorithm"""
+    ) -> np.ndarray:
+        """Cluster face embeddings using specified algorithm
         
-        if not detections:
-            return np.array([]), []
+        With DBSCAN and reassign_noise, noise faces are reassigned in a second
+        pass; its counts are added to report when given.
+        """
+        
+        if not len(detections):
+            return np.array([], dtype=np.int64)
+        
+        from sklearn.cluster import DBSCAN, AgglomerativeClustering, KMeans
         
         try:
-            embeddings = np.array([detection["embedding"] for detection in detections])
-            paths = [detection["image_path"] for detection in detections]
+            embeddings = detections.embeddings
             
             if algorithm == "dbscan":
                 eps = kwargs.get('eps', Config.DEFAULT_DBSCAN_EPS)
@@ -100,48 +303,20 @@ class ClusteringService:
                 raise ValueError(f"Unsupported clustering algorithm: {algorithm}")
             
             labels = clustering.fit_predict(embeddings)
-            return labels, paths
             
-        except Exception as e:
-            logger.error(f"Error in clustering: {e}")
-            return np.array([]), []
-
-    @staticmethod
-    def organize_clusters(detections: List[Dict], labels: np.ndarray, paths: List[str]) -> Dict:
-        """Organize clustering results into a structured format"""
-        from app.config import Config
-        from app.utils.image_processor import ImageProcessor
-        from app.utils.cache_manager import convert_numpy_types
-        
-        clusters = {}
-        
-        for i, label in enumerate(labels):
-            # Convert numpy int64 to regular int
-            label = int(label) if hasattr(label, 'item') else label
-            
-            if label == -1:  # Noise/unclustered
-                continue
-            
-            if label not in clusters:
-                clusters[label] = {
-                    'faces': [],
-                    'paths': [],
-                    'count': 0
-                }
+            if algorithm == "dbscan" and kwargs.get('reassign_noise', Config.NOISE_REASSIGNMENT):
+                from app.services.noise_reassignment import reassign_noise
+                
+                max_distance = kwargs.get('noise_distance') or eps * Config.NOISE_REASSIGN_DISTANCE_FACTOR
+                labels, reassignment = reassign_noise(
+                    embeddings, labels, clustering.core_sample_indices_, max_distance
+                )
+                logger.info(f"Noise reassignment: {reassignment}")
+                if report is not None:
+                    report.update(reassignment)
             
-            clusters[label]['paths'].append(paths[i])
-            clusters[label]['count'] += 1
+            return labels
             
-            # Add face images (limited number for performance)
-            if len(clusters[label]['faces']) < Config.MAX_FACES_PER_CLUSTER:
-                try:
-                    face_image, success = ImageProcessor.crop_face(
-                        paths[i], detections[i]['box']
-                    )
-                    if success:
-                        clusters[label]['faces'].append(face_image)
-                except Exception as e:
-                    logger.warning(f"Error cropping face from {paths[i]}: {e}")
-        
-        # Convert all numpy types in the clusters dictionary
-        return convert_numpy_types(clusters)
+        except Exception as e:
+            logger.error(f"Error in clustering: {e}")
+            return np.array([], dtype=np.int64)
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from typing import List, Dict, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class LocalInference:
+    """In-process face detection (MTCNN) and embedding (FaceNet)"""
+
+    def __init__(self):
+        # TensorFlow and the weights are only loaded on first use or by load()
+        self._embedder = None
+        self._detector = None
+        self._lock = threading.Lock()
+        self.load_error: Optional[str] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._embedder is not None
+
+    @property
+    def embedder(self):
+        """FaceNet model, loaded on first access"""
+        if self._embedder is None:
+            self.load()
+        return self._embedder
+
+    @property
+    def detector(self):
+        """MTCNN detector, loaded on first access"""
+        if self._detector is None:
+            self.load()
+        return self._detector
+
+    def load(self) -> None:
+        """Load the detector and the embedding model (thread-safe, idempotent)"""
+        with self._lock:
+            if self._embedder is not None:
+                return
+            try:
+                start = time.perf_counter()
+                from keras_facenet import FaceNet
+                from mtcnn import MTCNN
+                self._detector = MTCNN()
+                self._embedder = FaceNet()
+                self.load_error = None
+                logger.info(f"FaceNet model loaded in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                self.load_error = str(e)
+                logger.error(f"Error loading FaceNet model: {e}")
+                raise
+
+    def detect(self, image: np.ndarray, threshold: float,
+               min_face_size: Optional[int] = None) -> List[Dict]:
+        """Detect faces, returning box/confidence/keypoints dicts above threshold
+        
+        min_face_size (pixels of image) defaults to MTCNN_MIN_FACE_SIZE. The
+        threshold is also MTCNN's final (ONet) cut-off, which otherwise drops
+        everything under 0.8 and hides low-confidence candidates.
+        """
+        from app.config import Config
+        
+        detections = self.detector.detect_faces(
+            image, min_face_size=min_face_size or Config.MTCNN_MIN_FACE_SIZE,
+            threshold_onet=threshold
+        )
+        return [d for d in detections if d['confidence'] >= threshold]
+
+    def embed(self, faces: List[np.ndarray]) -> np.ndarray:
+        """Compute embeddings for a list of face crops"""
+        if not faces:
+            return np.zeros((0, 512), dtype=np.float32)
+        return np.asarray(self.embedder.embeddings(faces), dtype=np.float32)
+
+def crop_detection(image: np.ndarray, box: List[int]) -> np.ndarray:
+    """Crop a detector box (x, y, w, h) from an image array, clamped to its bounds"""
+    x, y, w, h = [int(v) for v in box]
+    x, y = max(x, 0), max(y, 0)
+    return image[y:y + h, x:x + w]
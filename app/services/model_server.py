@@ -0,0 +1,256 @@
+"""Local inference daemon shared by all web workers.
+
+A single process owns the FaceNet model and serves detect/embed requests over
+a Unix socket, grouping concurrent requests into batches. Start it with:
+
+    python -m app.services.model_server --socket /tmp/face_model.sock
+
+and set FACE_MODEL_SOCKET to the same path for the web workers.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+from app.config import Config
+from app.services.inference import LocalInference
+from app.utils.cache_manager import convert_numpy_types
+
+logger = logging.getLogger(__name__)
+
+_HEADER_SIZE = struct.Struct('!I')
+
+class ModelServerUnavailable(Exception):
+    """The model server cannot be reached (fall back to in-process inference)"""
+
+class ModelServerError(Exception):
+    """The model server reported an error while processing a request"""
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+def send_message(sock: socket.socket, header: Dict, arrays: List[np.ndarray] = ()) -> None:
+    """Send a JSON header followed by the raw bytes of each array"""
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    header = dict(header, arrays=[{'dtype': a.dtype.str, 'shape': a.shape} for a in arrays])
+    encoded = json.dumps(convert_numpy_types(header)).encode('utf-8')
+    sock.sendall(_HEADER_SIZE.pack(len(encoded)) + encoded)
+    for array in arrays:
+        sock.sendall(array.tobytes())
+
+def recv_message(sock: socket.socket) -> Tuple[Dict, List[np.ndarray]]:
+    """Receive a message sent with send_message"""
+    (size,) = _HEADER_SIZE.unpack(_recv_exact(sock, _HEADER_SIZE.size))
+    header = json.loads(_recv_exact(sock, size).decode('utf-8'))
+    arrays = []
+    for spec in header.pop('arrays', []):
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays.append(np.frombuffer(_recv_exact(sock, nbytes), dtype=dtype).reshape(shape))
+    return header, arrays
+
+class _BatchingRequestHandler(socketserver.BaseRequestHandler):
+    """One connection: a sequence of request/response messages"""
+
+    def handle(self):
+        server: 'ModelServer' = self.server.model_server
+        while True:
+            try:
+                header, arrays = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                response, out_arrays = server.submit(header, arrays)
+            except Exception as e:
+                response, out_arrays = {'error': str(e)}, []
+            try:
+                send_message(self.request, response, out_arrays)
+            except OSError:
+                return
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ModelServer:
+    """Owns the model and applies dynamic batching to queued requests"""
+
+    def __init__(self, socket_path: str, max_batch: int = None, batch_wait_ms: float = None,
+                 queue_size: int = None):
+        self.socket_path = socket_path
+        self.max_batch = max_batch or Config.MODEL_SERVER_MAX_BATCH
+        self.batch_wait = (batch_wait_ms if batch_wait_ms is not None
+                           else Config.MODEL_SERVER_BATCH_WAIT_MS) / 1000.0
+        self.requests = queue.Queue(maxsize=queue_size or Config.MODEL_SERVER_QUEUE_SIZE)
+        self.inference = LocalInference()
+        self._server: Optional[_UnixServer] = None
+
+    def submit(self, header: Dict, arrays: List[np.ndarray]) -> Tuple[Dict, List[np.ndarray]]:
+        """Queue a request for the batching thread and wait for its result"""
+        op = header.get('op')
+        if op == 'ping':
+            return {'ok': True, 'ready': self.inference.is_ready}, []
+        if op not in ('detect', 'embed'):
+            raise ValueError(f"Unsupported operation: {op}")
+
+        future = Future()
+        try:
+            self.requests.put_nowait((op, header, arrays, future))
+        except queue.Full:
+            raise RuntimeError("Model server queue is full")
+        return future.result()
+
+    def _next_batch(self) -> List:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch: List) -> None:
+        """Detect per image, then embed the crops of every embed request in one model call"""
+        crops: List[np.ndarray] = []
+        pending = []  # (future, start, stop)
+
+        for op, header, arrays, future in batch:
+            try:
+                if op == 'embed':
+                    start = len(crops)
+                    crops.extend(arrays)
+                    pending.append((future, start, len(crops)))
+                    continue
+
+                threshold = float(header.get('threshold', Config.FACE_DETECTION_THRESHOLD))
+                detections = self.inference.detect(arrays[0], threshold, header.get('min_face_size'))
+                future.set_result(({'detections': detections}, []))
+            except Exception as e:
+                future.set_exception(e)
+
+        if not pending:
+            return
+        try:
+            embeddings = self.inference.embed(crops)
+        except Exception as e:
+            for future, _, _ in pending:
+                future.set_exception(e)
+            return
+
+        for future, start, stop in pending:
+            future.set_result(({}, [embeddings[start:stop]]))
+
+    def _batch_loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                logger.error(f"Error running inference batch: {e}")
+
+    def serve_forever(self) -> None:
+        """Load the model, bind the socket and serve until interrupted"""
+        self.inference.load()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _UnixServer(self.socket_path, _BatchingRequestHandler)
+        self._server.model_server = self
+        os.chmod(self.socket_path, 0o660)
+
+        threading.Thread(target=self._batch_loop, name='inference-batcher', daemon=True).start()
+        logger.info(f"Model server listening on {self.socket_path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+class ModelClient:
+    """Thin client for ModelServer, exposing the LocalInference interface"""
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.timeout = timeout or Config.MODEL_SERVER_TIMEOUT
+        self._local = threading.local()  # one connection per worker thread
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            if not hasattr(socket, 'AF_UNIX'):
+                raise ModelServerUnavailable("Unix sockets are not supported on this platform")
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+            except OSError as e:
+                raise ModelServerUnavailable(f"Cannot connect to {self.socket_path}: {e}")
+            self._local.sock = sock
+        return sock
+
+    def _request(self, header: Dict, arrays: List[np.ndarray] = ()) -> Tuple[Dict, List[np.ndarray]]:
+        sock = self._connection()
+        try:
+            send_message(sock, header, arrays)
+            response, out_arrays = recv_message(sock)
+        except (ConnectionError, OSError) as e:
+            self._local.sock = None
+            sock.close()
+            raise ModelServerUnavailable(str(e))
+        if 'error' in response:
+            raise ModelServerError(response['error'])
+        return response, out_arrays
+
+    def ping(self) -> Dict:
+        response, _ = self._request({'op': 'ping'})
+        return response
+
+    def detect(self, image: np.ndarray, threshold: float,
+               min_face_size: Optional[int] = None) -> List[Dict]:
+        response, _ = self._request(
+            {'op': 'detect', 'threshold': threshold, 'min_face_size': min_face_size}, [image]
+        )
+        return response['detections']
+
+    def embed(self, faces: List[np.ndarray]) -> np.ndarray:
+        if not faces:
+            return np.zeros((0, 512), dtype=np.float32)
+        _, arrays = self._request({'op': 'embed'}, faces)
+        return arrays[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared face detection/embedding server")
+    parser.add_argument('--socket', default=Config.MODEL_SERVER_SOCKET or '/tmp/face_model.sock',
+                        help="Unix socket path")
+    parser.add_argument('--max-batch', type=int, default=Config.MODEL_SERVER_MAX_BATCH)
+    parser.add_argument('--batch-wait-ms', type=float, default=Config.MODEL_SERVER_BATCH_WAIT_MS)
+    parser.add_argument('--queue-size', type=int, default=Config.MODEL_SERVER_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s %(message)s'
+    )
+    ModelServer(args.socket, args.max_batch, args.batch_wait_ms, args.queue_size).serve_forever()
+
+if __name__ == '__main__':
+    main()
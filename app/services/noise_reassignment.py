@@ -0,0 +1,54 @@
+"""Second pass over DBSCAN noise.
+
+Noise faces within max_distance of a core point join that core point's
+cluster; the remaining noise is grouped into pair clusters (mutual nearest
+neighbours within max_distance) and singleton clusters, so people seen in only
+one or two photos still surface. Only noise points are queried (nearest
+neighbour search against core points, then among the remaining noise), so
+DBSCAN is not rerun and the work follows the number of noise points.
+"""
+from typing import Dict, Tuple
+import numpy as np
+
+def reassign_noise(embeddings: np.ndarray, labels: np.ndarray, core_indices: np.ndarray,
+                   max_distance: float) -> Tuple[np.ndarray, Dict]:
+    """New labels (noise reassigned) and counts of what was done"""
+    from sklearn.neighbors import NearestNeighbors
+
+    labels = np.array(labels, dtype=np.int64)
+    core_indices = np.asarray(core_indices, dtype=np.int64)
+    noise = np.flatnonzero(labels == -1)
+    report = {'reassigned_faces': 0, 'pair_clusters': 0, 'singleton_clusters': 0}
+    if not len(noise):
+        return labels, report
+
+    # Attach to the cluster of the nearest core point
+    if len(core_indices):
+        index = NearestNeighbors(n_neighbors=1).fit(embeddings[core_indices])
+        distances, nearest = index.kneighbors(embeddings[noise])
+        attach = distances[:, 0] <= max_distance
+        labels[noise[attach]] = labels[core_indices[nearest[attach, 0]]]
+        report['reassigned_faces'] = int(attach.sum())
+        noise = noise[~attach]
+
+    # Remaining noise: mutual nearest neighbours within max_distance form pairs
+    next_label = int(labels.max()) + 1 if (labels >= 0).any() else 0
+    paired = np.zeros(len(noise), dtype=bool)
+    if len(noise) >= 2:
+        index = NearestNeighbors(n_neighbors=1).fit(embeddings[noise])
+        distances, nearest = index.kneighbors()  # excludes each point itself
+        partner = nearest[:, 0]
+        positions = np.arange(len(noise))
+        first = ((partner[partner] == positions) & (positions < partner)
+                 & (distances[:, 0] <= max_distance))
+        pair_labels = next_label + np.arange(int(first.sum()))
+        labels[noise[first]] = pair_labels
+        labels[noise[partner[first]]] = pair_labels
+        paired[first] = paired[partner[first]] = True
+        next_label += len(pair_labels)
+        report['pair_clusters'] = len(pair_labels)
+
+    singletons = noise[~paired]
+    labels[singletons] = next_label + np.arange(len(singletons))
+    report['singleton_clusters'] = len(singletons)
+    return labels, report
@@ -0,0 +1,211 @@
+"""Headless, sharded face extraction (no Flask).
+
+A directory's sorted file manifest is split into N shards; each shard is
+processed independently (on any machine) into self-contained ``.npz`` files
+which are then merged into the embedding cache. Image paths are stored
+relative to the extracted directory and rebased at merge time, so shards made
+on machines with different mount points merge into the same cache keys.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+from typing import List, Tuple, Dict, Set
+import numpy as np
+from app.config import Config
+from app.utils.detection_set import DetectionSet
+
+logger = logging.getLogger(__name__)
+
+SHARD_FORMAT_VERSION = 3  # 2: per-image annotations (rejected faces, duplicate_of); 3: relative paths
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parse 'i/N' (0 <= i < N)"""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{spec}', expected 0 <= i < N")
+    return index, count
+
+def shard_manifest(directory: str, index: int, count: int) -> List[str]:
+    """Absolute paths of one shard: every N-th file of the sorted manifest"""
+    from app.utils.image_processor import FileScanner
+    return sorted(FileScanner.scan_directory(os.path.abspath(directory)))[index::count]
+
+def _relocate(detections: DetectionSet, processed: List[str], annotations: Dict[str, Dict],
+              convert) -> Tuple[DetectionSet, List[str], Dict[str, Dict]]:
+    """Apply convert to every image path of a shard (detections, processed, annotations)"""
+    detections = DetectionSet(
+        detections.embeddings, detections.boxes, detections.confidences, detections.keypoints,
+        detections.path_index, [convert(p) for p in detections.paths]
+    )
+    relocated = {}
+    for image_path, annotation in annotations.items():
+        if 'duplicate_of' in annotation:
+            annotation = dict(annotation, duplicate_of=convert(annotation['duplicate_of']))
+        relocated[convert(image_path)] = annotation
+    return detections, [convert(p) for p in processed], relocated
+
+def write_shard_file(path: str, detections: DetectionSet, processed: List[str], meta: Dict,
+                     annotations: Dict[str, Dict] = None) -> None:
+    """Atomically write detections, processed image paths and their annotations to a .npz file
+
+    Paths are stored relative to meta['directory'], with '/' separators.
+    """
+    from app.utils.cache_manager import convert_numpy_types
+
+    root = meta['directory']
+    detections, processed, annotations = _relocate(
+        detections, processed, annotations or {},
+        lambda p: os.path.relpath(p, root).replace(os.sep, '/')
+    )
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            embeddings=detections.embeddings,
+            boxes=detections.boxes,
+            confidences=detections.confidences,
+            keypoints=detections.keypoints,
+            path_index=detections.path_index,
+            paths=np.array(detections.paths, dtype=str),
+            processed=np.array(processed, dtype=str),
+            annotations=np.array(json.dumps(convert_numpy_types(annotations))),
+            meta=np.array(json.dumps(dict(meta, version=SHARD_FORMAT_VERSION)))
+        )
+    os.replace(tmp_path, path)
+
+def read_shard_file(path: str, root: str = None) -> Tuple[DetectionSet, List[str], Dict, Dict[str, Dict]]:
+    """Read a file written by write_shard_file: detections, processed paths, meta, annotations
+
+    Paths are rebased onto root (by default the directory the shard was
+    extracted from); shards before version 3 keep the paths they stored.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        detections = DetectionSet(
+            data['embeddings'], data['boxes'], data['confidences'], data['keypoints'],
+            data['path_index'], data['paths'].tolist()
+        )
+        # Version 1 shards carry no annotations
+        annotations = json.loads(str(data['annotations'])) if 'annotations' in data.files else {}
+        processed, meta = data['processed'].tolist(), json.loads(str(data['meta']))
+    if meta.get('version', 1) >= 3:
+        root = os.path.abspath(root or meta['directory'])
+        detections, processed, annotations = _relocate(
+            detections, processed, annotations, lambda p: os.path.normpath(os.path.join(root, p))
+        )
+    return detections, processed, meta, annotations
+
+def run_shard(directory: str, index: int, count: int, output_dir: str,
+              chunk_size: int = None) -> str:
+    """Extract one shard, resumably; returns the path of the finished shard file
+
+    Progress is checkpointed as part files every chunk_size images; on restart
+    images already present in a part are skipped.
+    """
+    from app.services.face_service import FaceDetectionService
+
+    chunk_size = chunk_size or Config.SHARD_CHUNK_SIZE
+    name = f"shard-{index:04d}-of-{count:04d}"
+    shard_path = os.path.join(output_dir, name + '.npz')
+    parts_dir = os.path.join(output_dir, name + '.parts')
+    if os.path.exists(shard_path):
+        logger.info(f"{shard_path} already complete")
+        return shard_path
+    os.makedirs(parts_dir, exist_ok=True)
+
+    meta = {'directory': os.path.abspath(directory), 'shard': index, 'num_shards': count}
+    manifest = shard_manifest(directory, index, count)
+
+    done: Set[str] = set()
+    part_files = sorted(glob.glob(os.path.join(parts_dir, 'part-*.npz')))
+    for part_file in part_files:
+        _, processed, _, _ = read_shard_file(part_file)
+        done.update(processed)
+    remaining = [path for path in manifest if path not in done]
+    logger.info(f"Shard {index}/{count}: {len(manifest)} images, {len(remaining)} to process")
+
+    service = FaceDetectionService()
+    part_number = len(part_files)
+    for start in range(0, len(remaining), chunk_size):
+        chunk = remaining[start:start + chunk_size]
+        report: Dict = {}
+        detections, processed = asyncio.run(service.detect_faces_async(chunk, report))
+        part_file = os.path.join(parts_dir, f"part-{part_number:05d}.npz")
+        write_shard_file(part_file, detections, processed, dict(meta, created=time.time()),
+                         report.get('annotations'))
+        part_number += 1
+        logger.info(f"Shard {index}/{count}: {start + len(chunk)}/{len(remaining)} images, "
+                    f"{len(detections)} faces in last chunk")
+
+    # Consolidate the parts into a single self-contained shard file
+    sets, processed, annotations = [], [], {}
+    for part_file in sorted(glob.glob(os.path.join(parts_dir, 'part-*.npz'))):
+        part_detections, part_processed, _, part_annotations = read_shard_file(part_file)
+        sets.append(part_detections)
+        processed.extend(part_processed)
+        annotations.update(part_annotations)
+    write_shard_file(shard_path, DetectionSet.concat(sets), processed,
+                     dict(meta, created=time.time(), images=len(manifest)), annotations)
+    shutil.rmtree(parts_dir)
+    logger.info(f"Shard {index}/{count} written to {shard_path}")
+    return shard_path
+
+def merge_shards(shard_paths: List[str], embedding_cache, overwrite: bool = False,
+                 root: str = None) -> Dict:
+    """Merge shard files into the embedding cache, deduplicating image paths
+
+    When an image appears in several shards the most recent shard wins; images
+    already cached are kept unless overwrite is set. root is where the
+    extracted directory is found on this machine (default: where it was on the
+    extracting machine). Nothing is evicted: CacheBudgetExceeded is raised, and
+    the cache file left as it was, when the shards do not fit in the budget.
+    """
+    files = []
+    for path in shard_paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '*.npz')))
+            files.extend(glob.glob(os.path.join(path, '*.parts', 'part-*.npz')))
+        else:
+            files.append(path)
+
+    # Order by creation time from the metadata only, then load one file at a time
+    created = {}
+    for path in files:
+        with np.load(path, allow_pickle=False) as data:
+            created[path] = json.loads(str(data['meta'])).get('created', 0.0)
+    files.sort(key=created.get, reverse=True)
+
+    seen: Set[str] = set()
+    stats = {'files': len(files), 'images': 0, 'faces': 0, 'duplicates': 0, 'already_cached': 0}
+    for path in files:
+        detections, processed, _, annotations = read_shard_file(path, root)
+        keep = []
+        for image_path in processed:
+            if image_path in seen:
+                stats['duplicates'] += 1
+            elif not overwrite and embedding_cache.get(image_path) is not None:
+                stats['already_cached'] += 1
+            else:
+                keep.append(image_path)
+            seen.add(image_path)
+        if not keep:
+            continue
+
+        kept = set(keep)
+        path_kept = np.array([p in kept for p in detections.paths], dtype=bool)
+        kept_detections = detections.subset(np.flatnonzero(path_kept[detections.path_index]))
+        embedding_cache.set_many(kept_detections, keep,
+                                 {p: annotations[p] for p in keep if p in annotations}, evict=False)
+        stats['images'] += len(keep)
+        stats['faces'] += len(kept_detections)
+        logger.info(f"Merged {len(keep)} images from {path}")
+
+    embedding_cache.save_cache()
+    stats['cache_entries'] = len(embedding_cache.cache)
+    return stats
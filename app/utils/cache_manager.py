@@ -1,9 +1,16 @@
 import json
 import logging
-from typing import Dict, List, Optional
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Iterator
 from datetime import datetime, timedelta
 import numpy as np
 from app.config import Config
+from app.utils.detection_set import DetectionSet
+from app.utils.json_stream import JsonStreamReader
+from app.utils.cache_migration import iter_cache_entries, is_valid_record
 
 logger = logging.getLogger(__name__)
 
@@ -23,87 +30,318 @@ def convert_numpy_types(obj):
         return tuple(convert_numpy_types(item) for item in obj)
     return obj
 
+class CacheBudgetExceeded(Exception):
+    """Inserting the entries would evict others from the cache"""
+
+class EvictionPolicy(ABC):
+    """Chooses which cache entries to evict when the cache exceeds its budget"""
+    
+    def on_insert(self, path: str) -> None:
+        pass
+    
+    def on_clustered(self, directories: List[str]) -> None:
+        pass
+    
+    def on_directory_removed(self, directory: str) -> None:
+        """The last cached entry of directory was removed"""
+        pass
+    
+    @abstractmethod
+    def victims(self, cache: 'EmbeddingCache') -> Iterator[str]:
+        """Paths to evict, in order"""
+
+class LRUEvictionPolicy(EvictionPolicy):
+    """Least recently used entries first"""
+    
+    def victims(self, cache: 'EmbeddingCache') -> Iterator[str]:
+        # The cache keeps its entries in access order, oldest first
+        return iter(list(cache.cache.keys()))
+
+class DirectoryEvictionPolicy(EvictionPolicy):
+    """Entries of the least recently clustered (or extracted) directory first"""
+    
+    def __init__(self):
+        self.last_used: Dict[str, float] = {}
+    
+    def on_insert(self, path: str) -> None:
+        import os
+        self.last_used[os.path.dirname(path)] = time.time()
+    
+    def on_clustered(self, directories: List[str]) -> None:
+        now = time.time()
+        for directory in directories:
+            self.last_used[directory] = now
+    
+    def on_directory_removed(self, directory: str) -> None:
+        self.last_used.pop(directory, None)
+    
+    def victims(self, cache: 'EmbeddingCache') -> Iterator[str]:
+        import os
+        directories = sorted(cache.manifest, key=lambda d: self.last_used.get(d, 0.0))
+        for directory in directories:
+            for name in list(cache.manifest.get(directory, ())):
+                yield os.path.join(directory, name)
+
+EVICTION_POLICIES = {
+    'lru': LRUEvictionPolicy,
+    'directory': DirectoryEvictionPolicy
+}
+
 class EmbeddingCache:
-    """Efficient caching system for face embeddings"""
+    """Efficient caching system for face embeddings
+    
+    Entries are kept in access order and bounded by entry count and by bytes
+    (CACHE_MAX_SIZE, CACHE_MAX_BYTES); a directory manifest maps each folder
+    to its cached file names for eviction and cleanup.
+    """
+    
+    # Approximate per-entry overhead (dict, timestamp, manifest) on top of the arrays
+    ENTRY_OVERHEAD = 512
     
-    def __init__(self, cache_file: str = None):
+    def __init__(self, cache_file: str = None, lazy: bool = False,
+                 max_entries: int = None, max_bytes: int = None,
+                 policy: Optional[EvictionPolicy] = None):
         self.cache_file = cache_file or Config.EMBEDDINGS_FILE
-        self.cache: Dict[str, Dict] = {}
-        self.load_cache()
+        self.max_entries = max_entries or Config.CACHE_MAX_SIZE
+        self.max_bytes = max_bytes or Config.CACHE_MAX_BYTES
+        self.policy = policy or EVICTION_POLICIES[Config.CACHE_EVICTION_POLICY]()
+        self._cache: Optional['OrderedDict[str, Dict]'] = None
+        self.manifest: Dict[str, set] = {}
+        self.total_bytes = 0
+        self._lock = threading.RLock()
+        self._cleanup_thread: Optional[threading.Thread] = None
+        if not lazy:
+            self.load_cache()
+    
+    @property
+    def cache(self) -> 'OrderedDict[str, Dict]':
+        """Cache entries, read from disk on first access when created lazily"""
+        if self._cache is None:
+            self.ensure_loaded()
+        return self._cache
+    
+    @property
+    def is_loaded(self) -> bool:
+        return self._cache is not None
+    
+    def ensure_loaded(self) -> None:
+        """Load the cache from disk unless it is already in memory"""
+        with self._lock:
+            if self._cache is None:
+                self.load_cache()
     
     def load_cache(self) -> None:
         """Load cache from disk"""
+        with self._lock:
+            self._reset()
+            self._load_cache()
+            self._enforce_limits()
+        if Config.AUTO_CLEANUP:
+            self.start_background_cleanup()
+    
+    def _reset(self) -> None:
+        for directory in self.manifest:
+            self.policy.on_directory_removed(directory)
+        self._cache = OrderedDict()
+        self.manifest = {}
+        self.total_bytes = 0
+    
+    def _load_cache(self) -> None:
+        """Read the cache file incrementally (memory bounded by the cache budget)"""
         try:
-            with open(self.cache_file, 'r') as f:
-                data = json.load(f)
-                self.cache = data.get('embeddings', {})
-                logger.info(f"Loaded {len(self.cache)} embeddings from cache")
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                for path, records, extra in iter_cache_entries(JsonStreamReader(f)):
+                    try:
+                        valid = [record for record in records if is_valid_record(record)]
+                        self._insert(path, self._entry_from_json(path, dict(extra, detections=valid)))
+                        self._enforce_limits()
+                    except Exception as entry_error:
+                        logger.warning(f"Skipping invalid cache entry {path}: {entry_error}")
+            logger.info(f"Loaded {len(self._cache)} embeddings from cache")
         except FileNotFoundError:
             logger.info("No cache file found, starting with empty cache")
-            self.cache = {}
         except Exception as e:
             logger.error(f"Error loading cache: {e}")
-            self.cache = {}
+            self._reset()
+    
+    @staticmethod
+    def _entry_from_json(path: str, entry: Dict) -> Dict:
+        """In-memory entry: detections held as a DetectionSet"""
+        return dict(entry, detections=DetectionSet.from_records(entry.get('detections', []), path))
+    
+    @staticmethod
+    def _entry_to_json(entry: Dict) -> Dict:
+        """JSON view of an in-memory entry"""
+        return convert_numpy_types(dict(entry, detections=entry['detections'].to_records()))
             
     def save_cache(self) -> None:
-        """Save cache to disk"""
+        """Save cache to disk, writing one entry at a time then replacing the file"""
+        import os
+        
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        with self._lock:
+            entries = list(self.cache.items())
+        
+        tmp_file = self.cache_file + '.tmp'
+        saved = 0
         try:
-            # Clean and convert all data before saving
-            clean_data = {
-                'embeddings': convert_numpy_types(self.cache),
-                'last_updated': datetime.now().isoformat(),
-                'version': '2.0'
-            }
-            with open(self.cache_file, 'w') as f:
-                json.dump(clean_data, f, indent=2)
-            logger.info(f"Saved {len(self.cache)} embeddings to cache")
-        except Exception as e:
-            logger.error(f"Error saving cache: {e}")
-            # Try to save without problematic entries
-            try:
-                clean_cache = {}
-                for path, entry in self.cache.items():
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write('{"embeddings": {')
+                for path, entry in entries:
                     try:
-                        # Test if entry can be serialized
-                        cleaned_entry = convert_numpy_types(entry)
-                        json.dumps(cleaned_entry)
-                        clean_cache[str(path)] = cleaned_entry
+                        encoded = json.dumps(self._entry_to_json(entry))
                     except Exception as entry_error:
                         logger.warning(f"Skipping problematic cache entry {path}: {entry_error}")
-                
-                fallback_data = {
-                    'embeddings': clean_cache,
-                    'last_updated': datetime.now().isoformat(),
-                    'version': '2.0'
-                }
-                with open(self.cache_file, 'w') as f:
-                    json.dump(fallback_data, f, indent=2)
-                logger.info(f"Saved {len(clean_cache)} clean embeddings to cache (fallback)")
-            except Exception as e2:
-                logger.error(f"Failed to save even clean cache: {e2}")
+                        continue
+                    f.write(f'{"," if saved else ""}\n{json.dumps(str(path))}: {encoded}')
+                    saved += 1
+                f.write(f'\n}}, "last_updated": {json.dumps(datetime.now().isoformat())}, '
+                        f'"version": "2.0"}}\n')
+            os.replace(tmp_file, self.cache_file)
+            logger.info(f"Saved {saved} embeddings to cache")
+        except Exception as e:
+            logger.error(f"Error saving cache: {e}")
 
-    def get(self, image_path: str) -> Optional[List[Dict]]:
+    def get(self, image_path: str) -> Optional[DetectionSet]:
         """Get cached embeddings for image"""
-        entry = self.cache.get(image_path)
-        if entry and self._is_valid_entry(entry):
-            return entry['detections']
+        entry = self.get_entry(image_path)
+        return entry['detections'] if entry is not None else None
+    
+    def get_entry(self, image_path: str) -> Optional[Dict]:
+        """Cached entry of an image (detections and annotations such as 'rejected')"""
+        with self._lock:
+            entry = self.cache.get(image_path)
+            if entry and self._is_valid_entry(entry):
+                self._cache.move_to_end(image_path)
+                return entry
         return None
     
-    def set(self, image_path: str, detections: List[Dict]) -> None:
+    def get_many(self, image_paths: List[str]) -> Tuple[DetectionSet, List[str]]:
+        """Cached detections of several images, and the paths that are not cached"""
+        found = []
+        missing = []
+        for path in image_paths:
+            detections = self.get(path)
+            if detections is None:
+                missing.append(path)
+            else:
+                found.append(detections)
+        return DetectionSet.concat(found), missing
+    
+    def set(self, image_path: str, detections: DetectionSet,
+            annotations: Optional[Dict] = None) -> None:
         """Cache embeddings for image"""
+        with self._lock:
+            self._set(image_path, detections, annotations)
+            self._enforce_limits()
+    
+    def set_many(self, detections: DetectionSet, image_paths: List[str],
+                 annotations: Optional[Dict[str, Dict]] = None, evict: bool = True) -> None:
+        """Cache the detections of several images (images without faces included)
+        
+        annotations maps image paths to extra entry fields, e.g. the faces the
+        quality gate rejected ('rejected', so they are not reconsidered) or the
+        near-duplicate image the detections were taken from ('duplicate_of').
+        With evict=False nothing is inserted and CacheBudgetExceeded is raised
+        when the images do not fit in the budget (bulk imports).
+        """
+        by_image = dict(detections.group_by_image())
+        empty = DetectionSet.empty()
+        annotations = annotations or {}
+        with self._lock:
+            if not evict and not self._fits(by_image, image_paths):
+                raise CacheBudgetExceeded(
+                    f"{len(image_paths)} more images do not fit in the cache budget "
+                    f"({len(self._cache)}/{self.max_entries} entries, "
+                    f"{self.total_bytes}/{self.max_bytes} bytes)"
+                )
+            for path in image_paths:
+                self._set(path, by_image.get(path, empty), annotations.get(path))
+            self._enforce_limits()
+    
+    def _set(self, image_path: str, detections: DetectionSet,
+             annotations: Optional[Dict] = None) -> None:
         import os
         try:
-            # Convert detections to ensure JSON compatibility
-            clean_detections = convert_numpy_types(detections)
-            
-            self.cache[str(image_path)] = {
-                'detections': clean_detections,
+            entry = convert_numpy_types(annotations) if annotations else {}
+            entry.update({
+                'detections': detections,
                 'timestamp': datetime.now().isoformat(),
                 'file_size': os.path.getsize(image_path) if os.path.exists(image_path) else 0
-            }
+            })
+            self._insert(str(image_path), entry)
         except Exception as e:
             logger.error(f"Error caching embeddings for {image_path}: {e}")
     
+    def _entry_size(self, path: str, entry: Dict) -> int:
+        return entry['detections'].nbytes + len(path) + self.ENTRY_OVERHEAD
+    
+    def _fits(self, by_image: Dict[str, DetectionSet], image_paths: List[str]) -> bool:
+        """Whether inserting these images keeps the cache within its limits"""
+        entries, total_bytes = len(self._cache), self.total_bytes
+        empty = DetectionSet.empty()
+        for path in set(image_paths):
+            previous = self._cache.get(path)
+            if previous is None:
+                entries += 1
+            else:
+                total_bytes -= self._entry_size(path, previous)
+            total_bytes += self._entry_size(path, {'detections': by_image.get(path, empty)})
+        return entries <= self.max_entries and total_bytes <= self.max_bytes
+    
+    def _insert(self, path: str, entry: Dict) -> None:
+        """Add or replace an entry, keeping size accounting and manifest up to date"""
+        import os
+        
+        if path in self._cache:
+            self._remove(path)
+        self._cache[path] = entry
+        self.total_bytes += self._entry_size(path, entry)
+        directory, name = os.path.split(path)
+        self.manifest.setdefault(directory, set()).add(name)
+        self.policy.on_insert(path)
+    
+    def _remove(self, path: str) -> None:
+        import os
+        
+        entry = self._cache.pop(path, None)
+        if entry is None:
+            return
+        self.total_bytes -= self._entry_size(path, entry)
+        directory, name = os.path.split(path)
+        names = self.manifest.get(directory)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.manifest[directory]
+                self.policy.on_directory_removed(directory)
+    
+    def _enforce_limits(self) -> None:
+        """Evict entries chosen by the policy until back under the target budget"""
+        if len(self._cache) <= self.max_entries and self.total_bytes <= self.max_bytes:
+            return
+        
+        # Evict below the limit so that eviction does not run on every insert
+        target_entries = int(self.max_entries * Config.CACHE_EVICTION_TARGET)
+        target_bytes = int(self.max_bytes * Config.CACHE_EVICTION_TARGET)
+        evicted = 0
+        for path in self.policy.victims(self):
+            if len(self._cache) <= target_entries and self.total_bytes <= target_bytes:
+                break
+            if path in self._cache:
+                self._remove(path)
+                evicted += 1
+        
+        logger.info(f"Evicted {evicted} cache entries "
+                    f"({len(self._cache)} entries, {self.total_bytes // 1024} KB left)")
+    
+    def mark_clustered(self, image_paths: List[str]) -> None:
+        """Record that the directories of these images were just clustered"""
+        import os
+        with self._lock:
+            directories = {os.path.dirname(path) for path in image_paths} & self.manifest.keys()
+        self.policy.on_clustered(list(directories))
+    
     def _is_valid_entry(self, entry: Dict) -> bool:
         """Check if cache entry is still valid"""
         try:
@@ -112,20 +350,50 @@ class EmbeddingCache:
         except:
             return False
     
-    def cleanup_invalid_entries(self) -> None:
-        """Remove invalid cache entries"""
+    def cleanup_invalid_entries(self, batch_size: int = None) -> int:
+        """Remove expired entries and entries whose file no longer exists
+        
+        Uses one directory listing per manifest directory instead of a stat per
+        entry, and holds the lock for one batch of directories at a time.
+        """
         import os
         
-        invalid_keys = []
-        for path, entry in self.cache.items():
-            if not os.path.exists(path) or not self._is_valid_entry(entry):
-                invalid_keys.append(path)
+        batch_size = batch_size or Config.CACHE_CLEANUP_BATCH_SIZE
+        self.ensure_loaded()
+        with self._lock:
+            directories = list(self.manifest)
         
-        for key in invalid_keys:
-            del self.cache[key]
+        removed = 0
+        for start in range(0, len(directories), batch_size):
+            listings = {}
+            for directory in directories[start:start + batch_size]:
+                try:
+                    listings[directory] = set(os.listdir(directory))
+                except OSError:
+                    listings[directory] = set()
+            
+            with self._lock:
+                for directory, existing in listings.items():
+                    for name in list(self.manifest.get(directory, ())):
+                        path = os.path.join(directory, name)
+                        entry = self._cache.get(path)
+                        if name not in existing or (entry and not self._is_valid_entry(entry)):
+                            self._remove(path)
+                            removed += 1
         
-        if invalid_keys:
-            logger.info(f"Cleaned up {len(invalid_keys)} invalid cache entries")
+        if removed:
+            logger.info(f"Cleaned up {removed} invalid cache entries")
+        return removed
+    
+    def start_background_cleanup(self) -> None:
+        """Run cleanup_invalid_entries in a daemon thread (one at a time)"""
+        with self._lock:
+            if self._cleanup_thread is not None and self._cleanup_thread.is_alive():
+                return
+            self._cleanup_thread = threading.Thread(
+                target=self.cleanup_invalid_entries, name='cache-cleanup', daemon=True
+            )
+            self._cleanup_thread.start()
 
 class MetadataManager:
     """Manage EXIF metadata operations"""
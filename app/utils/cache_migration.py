@@ -0,0 +1,186 @@
+"""Streaming import of legacy and current-format JSON embedding caches.
+
+Supported layouts:
+- current cache: {"embeddings": {path: {"detections": [...], ...}}, ...}
+- path mapping: {path: [detection, ...]} or {path: {"detections": [...]}}
+- flat list: [detection, ...] where each detection carries its image path
+  (image_path, path or keypath), as written by the first versions of the tool
+"""
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from app.config import Config
+from app.utils.detection_set import DetectionSet, EMBEDDING_DIM
+from app.utils.json_stream import JsonStreamReader
+
+logger = logging.getLogger(__name__)
+
+PATH_KEYS = ('image_path', 'path', 'keypath', 'key_path')
+
+def _record_path(record: Dict) -> Optional[str]:
+    for key in PATH_KEYS:
+        if isinstance(record.get(key), str):
+            return record[key]
+    return None
+
+def is_valid_record(record) -> bool:
+    """A detection needs a 4-value box and a finite 512-d embedding"""
+    try:
+        box = record['box']
+        embedding = np.asarray(record['embedding'], dtype=np.float32)
+        return (len(box) == 4 and embedding.shape == (EMBEDDING_DIM,)
+                and bool(np.isfinite(embedding).all()))
+    except (KeyError, TypeError, ValueError):
+        return False
+
+def _split_entry(value) -> Tuple[List, Dict]:
+    """Records and extra fields of a per-image value (entry dict or list of records)"""
+    if isinstance(value, list):
+        return value, {}
+    if isinstance(value, dict):
+        extra = {k: v for k, v in value.items() if k != 'detections'}
+        return value.get('detections', []), extra
+    raise ValueError("Unsupported entry")
+
+def _iter_record_list(reader: JsonStreamReader) -> Iterator[Tuple[str, List[Dict], Dict]]:
+    """Flat list of records, grouped by consecutive image path"""
+    current_path, records = None, []
+    for _ in reader.iter_array():
+        record = reader.read_value()
+        path = _record_path(record) if isinstance(record, dict) else None
+        if path is None:
+            records.append(record)  # Reported as invalid by the caller
+            continue
+        if path != current_path and current_path is not None:
+            yield current_path, records, {}
+            records = []
+        current_path = path
+        records.append(record)
+    if current_path is not None:
+        yield current_path, records, {}
+
+def _iter_path_mapping(reader: JsonStreamReader) -> Iterator[Tuple[str, List[Dict], Dict]]:
+    for path in reader.iter_object():
+        records, extra = _split_entry(reader.read_value())
+        yield path, records, extra
+
+def _has_embeddings_key(reader: JsonStreamReader) -> bool:
+    """Whether the top-level object has an 'embeddings' key; rewinds the reader
+
+    Keys are checked without being kept, and current cache files write
+    'embeddings' first, so this usually stops at the first key.
+    """
+    try:
+        for key in reader.iter_object():
+            if key == 'embeddings':
+                return True
+            reader.skip_value()
+        return False
+    finally:
+        reader.rewind()
+
+def iter_cache_entries(reader: JsonStreamReader) -> Iterator[Tuple[str, List[Dict], Dict]]:
+    """Yield (image_path, detection records, extra entry fields) from any supported layout"""
+    if reader.peek() == '[':
+        yield from _iter_record_list(reader)
+        return
+
+    # Top-level keys are image paths only in legacy files without 'embeddings'
+    legacy_mapping = not _has_embeddings_key(reader)
+    for key in reader.iter_object():
+        if key == 'embeddings':
+            if reader.peek() == '[':
+                yield from _iter_record_list(reader)
+            else:
+                yield from _iter_path_mapping(reader)
+        elif legacy_mapping and reader.peek() in ('[', '{'):
+            # Legacy mapping of image path -> detections
+            records, extra = _split_entry(reader.read_value())
+            yield key, records, extra
+        else:
+            reader.skip_value()  # last_updated, version, unknown keys
+
+def backup_cache_file(cache_file: str) -> Optional[str]:
+    """Copy the cache file next to itself with a timestamp suffix"""
+    if not os.path.exists(cache_file):
+        return None
+    backup_path = f"{cache_file}.{datetime.now().strftime('%Y%m%d-%H%M%S')}.bak"
+    shutil.copy2(cache_file, backup_path)
+    logger.info(f"Backed up {cache_file} to {backup_path}")
+    return backup_path
+
+def import_cache(source: str, embedding_cache, batch_size: int = None,
+                 backup: Optional[bool] = None, chunk_size: int = 1 << 20) -> Dict:
+    """Stream a legacy or current-format JSON cache into the embedding cache
+
+    Entries are validated and inserted in batches of batch_size images; the
+    existing cache file is backed up first (BACKUP_ON_MIGRATE). Nothing is
+    evicted: CacheBudgetExceeded is raised, and the cache file left as it was,
+    when the source does not fit in the cache's max_entries/max_bytes.
+    """
+    batch_size = batch_size or Config.MIGRATION_BATCH_SIZE
+    backup = Config.BACKUP_ON_MIGRATE if backup is None else backup
+
+    embedding_cache.ensure_loaded()
+    stats = {'images': 0, 'faces': 0, 'invalid_faces': 0, 'backup': None}
+    if backup:
+        stats['backup'] = backup_cache_file(embedding_cache.cache_file)
+
+    # Entries written from here on were imported by this run (memory stays
+    # bounded by one batch: earlier images are looked up in the cache)
+    started = datetime.now().isoformat()
+    records: List[Dict] = []
+    paths: List[str] = []
+    batch_paths: Set[str] = set()
+    annotations: Dict[str, Dict] = {}
+
+    def flush():
+        if paths:
+            embedding_cache.set_many(DetectionSet.from_records(records), paths, annotations,
+                                     evict=False)
+            logger.info(f"Imported {stats['images']} images ({stats['faces']} faces)")
+        records.clear()
+        paths.clear()
+        batch_paths.clear()
+        annotations.clear()
+
+    def imported_entry(path: str) -> Optional[Dict]:
+        entry = embedding_cache.get_entry(path)
+        return entry if entry is not None and entry.get('timestamp', '') >= started else None
+
+    with open(source, 'r', encoding='utf-8') as f:
+        for path, entry_records, extra in iter_cache_entries(JsonStreamReader(f, chunk_size)):
+            valid = []
+            for record in entry_records:
+                if is_valid_record(record):
+                    valid.append(dict(record, image_path=path))
+                else:
+                    stats['invalid_faces'] += 1
+
+            stats['faces'] += len(valid)
+            if path in batch_paths:
+                flush()
+            previous = imported_entry(path)
+            if previous is not None:
+                # Same image seen again (unsorted flat list): extend what was imported
+                valid = previous['detections'].to_records() + valid
+                if 'rejected' in previous:
+                    extra = dict(extra, rejected=previous['rejected'] + extra.get('rejected', []))
+            else:
+                stats['images'] += 1
+
+            records.extend(valid)
+            paths.append(path)
+            batch_paths.add(path)
+            if 'rejected' in extra:
+                annotations[path] = {'rejected': extra['rejected']}
+            if len(paths) >= batch_size:
+                flush()
+    flush()
+
+    embedding_cache.save_cache()
+    stats['cache_entries'] = len(embedding_cache.cache)
+    return stats
@@ -0,0 +1,170 @@
+import hashlib
+from typing import List, Dict, Tuple, Iterator, Iterable, Optional
+import numpy as np
+
+EMBEDDING_DIM = 512
+KEYPOINT_NAMES = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
+
+def group_indices(keys: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Vectorised group-by: unique keys and the (sorted) indices of each group"""
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    unique, starts = np.unique(keys[order], return_index=True)
+    return unique, np.split(order, starts[1:]) if len(order) else []
+
+class DetectionSet:
+    """Struct-of-arrays face detections: one row per face, image paths interned"""
+
+    def __init__(self, embeddings: np.ndarray, boxes: np.ndarray, confidences: np.ndarray,
+                 keypoints: np.ndarray, path_index: np.ndarray, paths: List[str]):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+        self.keypoints = np.asarray(keypoints, dtype=np.float32).reshape(-1, len(KEYPOINT_NAMES), 2)
+        self.path_index = np.asarray(path_index, dtype=np.int32).reshape(-1)
+        self.paths = paths if isinstance(paths, list) else list(paths)
+
+    @classmethod
+    def empty(cls) -> 'DetectionSet':
+        return cls(
+            np.zeros((0, EMBEDDING_DIM)), np.zeros((0, 4)), np.zeros(0),
+            np.zeros((0, len(KEYPOINT_NAMES), 2)), np.zeros(0), []
+        )
+
+    @classmethod
+    def from_records(cls, records: List[Dict], image_path: Optional[str] = None) -> 'DetectionSet':
+        """Build from detector output or JSON records (dicts with box, embedding, ...)"""
+        if not records:
+            return cls.empty()
+
+        paths: List[str] = []
+        interned: Dict[str, int] = {}
+        path_index = np.empty(len(records), dtype=np.int32)
+        keypoints = np.zeros((len(records), len(KEYPOINT_NAMES), 2), dtype=np.float32)
+
+        for i, record in enumerate(records):
+            path = image_path if image_path is not None else record['image_path']
+            index = interned.get(path)
+            if index is None:
+                index = interned[path] = len(paths)
+                paths.append(path)
+            path_index[i] = index
+
+            points = record.get('keypoints') or {}
+            for k, name in enumerate(KEYPOINT_NAMES):
+                if name in points:
+                    keypoints[i, k] = points[name]
+
+        return cls(
+            np.stack([np.asarray(r['embedding'], dtype=np.float32) for r in records]),
+            np.array([r['box'] for r in records]),
+            np.array([r.get('confidence', 0.0) for r in records]),
+            keypoints, path_index, paths
+        )
+
+    @classmethod
+    def concat(cls, sets: Iterable['DetectionSet']) -> 'DetectionSet':
+        """Concatenate several sets, re-interning their image paths"""
+        sets = [s for s in sets if len(s)]
+        if not sets:
+            return cls.empty()
+        if len(sets) == 1:
+            return sets[0]
+
+        paths: List[str] = []
+        interned: Dict[str, int] = {}
+        remapped = []
+        for s in sets:
+            mapping = np.empty(len(s.paths), dtype=np.int32)
+            for j, path in enumerate(s.paths):
+                index = interned.get(path)
+                if index is None:
+                    index = interned[path] = len(paths)
+                    paths.append(path)
+                mapping[j] = index
+            remapped.append(mapping[s.path_index])
+
+        return cls(
+            np.concatenate([s.embeddings for s in sets]),
+            np.concatenate([s.boxes for s in sets]),
+            np.concatenate([s.confidences for s in sets]),
+            np.concatenate([s.keypoints for s in sets]),
+            np.concatenate(remapped), paths
+        )
+
+    def __len__(self) -> int:
+        return len(self.path_index)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the arrays"""
+        return (self.embeddings.nbytes + self.boxes.nbytes + self.confidences.nbytes
+                + self.keypoints.nbytes + self.path_index.nbytes)
+
+    def _path_ranks(self) -> Tuple[List[str], np.ndarray]:
+        """Sorted image paths in use, and the rank of each row's path among them"""
+        used = np.unique(self.path_index)
+        used_paths = [self.paths[i] for i in used]
+        by_name = sorted(range(len(used_paths)), key=used_paths.__getitem__)
+        ranks = np.zeros(len(self.paths), dtype=np.int64)
+        ranks[used[by_name]] = np.arange(len(used_paths))
+        return [used_paths[i] for i in by_name], ranks[self.path_index]
+
+    def canonical_order(self) -> np.ndarray:
+        """Row permutation sorting by image path then box (independent of extraction order)"""
+        if getattr(self, '_canonical_order', None) is None:
+            _, path_ranks = self._path_ranks()
+            boxes = self.boxes
+            self._canonical_order = np.lexsort(
+                (self.confidences, boxes[:, 3], boxes[:, 2], boxes[:, 1], boxes[:, 0], path_ranks)
+            )
+        return self._canonical_order
+
+    def fingerprint(self) -> str:
+        """Content hash of the rows (embeddings, boxes, image paths) in canonical order, memoised"""
+        if getattr(self, '_fingerprint', None) is None:
+            order = self.canonical_order()
+            paths, path_ranks = self._path_ranks()
+            digest = hashlib.sha256()
+            for array in (self.embeddings[order], self.boxes[order], path_ranks[order]):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            digest.update('\0'.join(paths).encode('utf-8'))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def path_of(self, i: int) -> str:
+        return self.paths[self.path_index[i]]
+
+    def subset(self, indices: np.ndarray) -> 'DetectionSet':
+        """Rows at indices (paths are kept interned, not compacted)"""
+        return DetectionSet(
+            self.embeddings[indices], self.boxes[indices], self.confidences[indices],
+            self.keypoints[indices], self.path_index[indices], self.paths
+        )
+
+    def group_by_image(self) -> Iterator[Tuple[str, 'DetectionSet']]:
+        """Yield (image_path, detections of that image)"""
+        unique, groups = group_indices(self.path_index)
+        for index, rows in zip(unique, groups):
+            path = self.paths[index]
+            yield path, DetectionSet(
+                self.embeddings[rows], self.boxes[rows], self.confidences[rows],
+                self.keypoints[rows], np.zeros(len(rows), dtype=np.int32), [path]
+            )
+
+    def to_records(self) -> List[Dict]:
+        """JSON view (list of dicts), only used at the HTTP and file boundaries"""
+        embeddings = self.embeddings.tolist()
+        boxes = self.boxes.tolist()
+        confidences = self.confidences.tolist()
+        keypoints = self.keypoints.tolist()
+        return [
+            {
+                'box': boxes[i],
+                'confidence': confidences[i],
+                'keypoints': dict(zip(KEYPOINT_NAMES, keypoints[i])),
+                'embedding': embeddings[i],
+                'image_path': self.paths[self.path_index[i]]
+            }
+            for i in range(len(self))
+        ]
@@ -3,9 +3,7 @@ import base64
 import logging
 from typing import Optional, Tuple, List
 import numpy as np
-import rawpy
 from PIL import Image
-import cv2
 from app.config import Config
 
 logger = logging.getLogger(__name__)
@@ -14,14 +12,23 @@ class ImageProcessor:
     """Utility class for image processing operations"""
     
     @staticmethod
-    def load_image(image_path: str) -> Optional[np.ndarray]:
-        """Load image from path, supporting various formats including RAW"""
+    def load_image(image_path: str, max_size: Optional[int] = None) -> Optional[np.ndarray]:
+        """Load image from path, supporting various formats including RAW
+        
+        With max_size, JPEGs are decoded at the smallest scale that keeps the
+        longest side at least max_size (the caller still resizes).
+        """
         try:
             if image_path.lower().endswith('cr2'):
+                import rawpy
                 with rawpy.imread(image_path) as raw:
                     return raw.postprocess()
             else:
                 image = Image.open(image_path)
+                if max_size and max(image.size) > max_size:
+                    scaling_factor = max_size / max(image.size)
+                    image.draft('RGB', (int(image.size[0] * scaling_factor),
+                                        int(image.size[1] * scaling_factor)))
                 return np.asarray(image)
         except Exception as e:
             logger.error(f"Error loading image {image_path}: {e}")
@@ -30,6 +37,8 @@ class ImageProcessor:
     @staticmethod
     def resize_image(image: np.ndarray, max_size: int) -> np.ndarray:
         """Resize image while maintaining aspect ratio"""
+        import cv2
+        
         height, width = image.shape[:2]
         
         if height > width:
@@ -46,11 +55,17 @@ class ImageProcessor:
         try:            
             # Load image
             if image_path.lower().endswith('cr2'):
+                import rawpy
                 with rawpy.imread(image_path) as raw:
                     image_array = raw.postprocess()
                     image = Image.fromarray(image_array)
             else:
                 image = Image.open(image_path)
+                if image.size[0] > Config.MAX_IMAGE_SIZE or image.size[1] > Config.MAX_IMAGE_SIZE:
+                    # JPEG: decode directly at a reduced scale (no-op for other formats)
+                    scaling_factor = Config.MAX_IMAGE_SIZE / max(image.size)
+                    image.draft('RGB', (int(image.size[0] * scaling_factor),
+                                        int(image.size[1] * scaling_factor)))
             
             if image is None:
                 return "", False
@@ -0,0 +1,134 @@
+"""Incremental JSON reading in bounded memory.
+
+JsonStreamReader walks a JSON document from a file without loading it: the
+caller iterates objects and arrays and decodes only the leaf values it needs,
+so memory is bounded by the largest single value read, not by the file size.
+"""
+import json
+import re
+from typing import Any, Iterator, TextIO
+
+_WHITESPACE = ' \t\n\r'
+_TOKEN_END = re.compile(r'[,\]}\s]')  # What may follow a number, true, false or null
+_decoder = json.JSONDecoder()
+
+class JsonStreamReader:
+    """Pull-style reader over a text file containing JSON"""
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def rewind(self) -> None:
+        """Restart from the beginning of the file (which must be seekable)"""
+        self.f.seek(0)
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Append more text to the buffer (dropping the consumed prefix)"""
+        if self.eof:
+            return False
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        # Grow geometrically so that a large value is not re-parsed too many times
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer)))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return
+
+    def peek(self) -> str:
+        """Next significant character ('' at end of input)"""
+        self._skip_whitespace()
+        return self.buffer[self.pos] if self.pos < len(self.buffer) else ''
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' but found '{self.peek()}'")
+        self.pos += 1
+
+    def _complete_scalar(self) -> None:
+        """Read on until a delimiter follows the unquoted token at pos (or input ends)
+
+        A number cut by a chunk boundary ('0.' then '05') would otherwise be
+        decoded as its prefix.
+        """
+        while not _TOKEN_END.search(self.buffer, self.pos) and self._fill():
+            pass
+
+    def read_value(self) -> Any:
+        """Decode the next complete JSON value"""
+        self._skip_whitespace()
+        if self.pos < len(self.buffer) and self.buffer[self.pos] not in '"{[':
+            self._complete_scalar()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            self.pos = end
+            return value
+
+    def skip_value(self) -> None:
+        """Skip the next value, descending into containers to bound memory"""
+        char = self.peek()
+        if char == '{':
+            for _ in self.iter_object():
+                self.skip_value()
+        elif char == '[':
+            for _ in self.iter_array():
+                self.skip_value()
+        else:
+            self.read_value()
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the next object; the caller must consume each value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError("Object keys must be strings")
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or '}}' but found '{char}'")
+
+    def iter_array(self) -> Iterator[int]:
+        """Yield the indices of the next array; the caller must consume each element"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' but found '{char}'")
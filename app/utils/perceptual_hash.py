@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+
+HASH_BITS = 64
+
+def dhash(image: np.ndarray) -> int:
+    """64-bit difference hash: sign of horizontal gradients of a 9x8 grayscale thumbnail"""
+    import cv2
+
+    gray = image[..., :3].mean(axis=-1) if image.ndim == 3 else image
+    small = cv2.resize(gray.astype(np.float32), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+class PerceptualHashIndex:
+    """Nearest-neighbour index of 64-bit hashes under Hamming distance
+
+    Multi-index hashing: hashes are split into max_distance + 1 bands, so any
+    hash within max_distance shares at least one identical band with the query
+    (pigeonhole) and only those buckets are checked.
+    """
+
+    def __init__(self, max_distance: int, max_entries: int):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        num_bands = max_distance + 1
+        edges = np.linspace(0, HASH_BITS, num_bands + 1).astype(int)
+        self._bands: List[Tuple[int, int]] = [
+            (int(start), (1 << int(stop - start)) - 1) for start, stop in zip(edges[:-1], edges[1:])
+        ]
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in self._bands]
+        self._entries: 'OrderedDict[int, Tuple[int, Any]]' = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _keys(self, value: int) -> List[int]:
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, value: int, payload: Any) -> None:
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (value, payload)
+            for buckets, key in zip(self._buckets, self._keys(value)):
+                buckets.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                old_id, (old_value, _) = self._entries.popitem(last=False)
+                for buckets, key in zip(self._buckets, self._keys(old_value)):
+                    bucket = buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(old_id)
+                        if not bucket:
+                            del buckets[key]
+
+    def find(self, value: int) -> Optional[Tuple[int, Any]]:
+        """Closest (distance, payload) within max_distance, or None"""
+        best = None
+        with self._lock:
+            candidates: Set[int] = set()
+            for buckets, key in zip(self._buckets, self._keys(value)):
+                candidates.update(buckets.get(key, ()))
+            for entry_id in candidates:
+                other, payload = self._entries[entry_id]
+                distance = bin(value ^ other).count('1')
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, payload)
+        return best
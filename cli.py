@@ -0,0 +1,96 @@
+"""Command-line tools: headless sharded extraction, shard merging and cache import.
+
+    python cli.py extract /photos --shard 0/4 --output-dir ./shards
+    python cli.py merge ./shards --root /mnt/photos
+    python cli.py migrate save_emb_keypath.json
+"""
+import argparse
+import json
+import logging
+import sys
+from app.config import Config
+
+BUDGET_HINT = ("Raise --max-entries/--max-bytes, and CACHE_MAX_SIZE/CACHE_MAX_BYTES in the "
+               "environment of the web app so it does not evict the entries when loading the cache")
+
+def add_budget_arguments(parser):
+    parser.add_argument('--max-entries', type=int, default=Config.CACHE_MAX_SIZE,
+                        help="Embedding cache entry limit (CACHE_MAX_SIZE)")
+    parser.add_argument('--max-bytes', type=int, default=Config.CACHE_MAX_BYTES,
+                        help="Embedding cache byte limit (CACHE_MAX_BYTES)")
+
+def extract(args):
+    from app.services.sharded_extraction import parse_shard, run_shard
+
+    index, count = parse_shard(args.shard)
+    run_shard(args.directory, index, count, args.output_dir, args.chunk_size)
+
+def merge(args):
+    from app.services.sharded_extraction import merge_shards
+    from app.utils.cache_manager import CacheBudgetExceeded, EmbeddingCache
+
+    embedding_cache = EmbeddingCache(args.cache_file, max_entries=args.max_entries,
+                                     max_bytes=args.max_bytes)
+    try:
+        stats = merge_shards(args.shards, embedding_cache, overwrite=args.overwrite, root=args.root)
+    except CacheBudgetExceeded as e:
+        print(f"Merge aborted, {args.cache_file} unchanged: {e}. {BUDGET_HINT}", file=sys.stderr)
+        return 1
+    print(json.dumps(stats, indent=2))
+
+def migrate(args):
+    from app.utils.cache_manager import CacheBudgetExceeded, EmbeddingCache
+    from app.utils.cache_migration import import_cache
+
+    embedding_cache = EmbeddingCache(args.cache_file, max_entries=args.max_entries,
+                                     max_bytes=args.max_bytes)
+    try:
+        stats = import_cache(args.source, embedding_cache, args.batch_size,
+                             backup=False if args.no_backup else None)
+    except CacheBudgetExceeded as e:
+        print(f"Import aborted, {args.cache_file} unchanged: {e}. {BUDGET_HINT}", file=sys.stderr)
+        return 1
+    print(json.dumps(stats, indent=2))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Face clustering command-line tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    extract_parser = subparsers.add_parser('extract', help="Extract faces from one shard of a directory")
+    extract_parser.add_argument('directory', help="Image directory")
+    extract_parser.add_argument('--shard', default='0/1', help="Shard i/N to process (0 <= i < N)")
+    extract_parser.add_argument('--output-dir', default='./shards', help="Where shard files are written")
+    extract_parser.add_argument('--chunk-size', type=int, default=Config.SHARD_CHUNK_SIZE,
+                                help="Images per checkpoint")
+    extract_parser.set_defaults(func=extract)
+
+    merge_parser = subparsers.add_parser('merge', help="Merge shard files into the embedding cache")
+    merge_parser.add_argument('shards', nargs='+', help="Shard files or directories")
+    merge_parser.add_argument('--cache-file', default=Config.EMBEDDINGS_FILE)
+    merge_parser.add_argument('--overwrite', action='store_true',
+                              help="Replace images that are already cached")
+    merge_parser.add_argument('--root', help="Where the extracted directory is on this machine "
+                                             "(default: its path on the extracting machine)")
+    add_budget_arguments(merge_parser)
+    merge_parser.set_defaults(func=merge)
+
+    migrate_parser = subparsers.add_parser('migrate', aliases=['import'],
+                                           help="Import a legacy or current-format JSON cache")
+    migrate_parser.add_argument('source', nargs='?', default=Config.LEGACY_CACHE_FILE,
+                                help="JSON cache to import")
+    migrate_parser.add_argument('--cache-file', default=Config.EMBEDDINGS_FILE)
+    migrate_parser.add_argument('--batch-size', type=int, default=Config.MIGRATION_BATCH_SIZE)
+    migrate_parser.add_argument('--no-backup', action='store_true',
+                                help="Do not back up the cache file first")
+    add_budget_arguments(migrate_parser)
+    migrate_parser.set_defaults(func=migrate)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s %(message)s'
+    )
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
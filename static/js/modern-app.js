@@ -69,6 +69,10 @@ class FaceClusteringApp {
             this.cancelProcess();
         });
 
+        document.getElementById('load-more-clusters')?.addEventListener('click', () => {
+            this.loadMoreClusters();
+        });
+
         // Modal controls
         document.getElementById('modal-close')?.addEventListener('click', () => {
             this.closeModal();
@@ -134,6 +138,7 @@ class FaceClusteringApp {
             algorithm: document.getElementById('algorithm-select').value,
             eps: document.getElementById('eps-input').value,
             minSamples: document.getElementById('min-samples-input').value,
+            reassignNoise: document.getElementById('reassign-noise-input').checked,
             clusters: document.getElementById('clusters-input').value,
             lastDirectory: document.getElementById('directory-input').value
         };
@@ -153,6 +158,9 @@ class FaceClusteringApp {
         if (settings.minSamples) {
             document.getElementById('min-samples-input').value = settings.minSamples;
         }
+        if (settings.reassignNoise !== undefined) {
+            document.getElementById('reassign-noise-input').checked = settings.reassignNoise;
+        }
         if (settings.clusters) {
             document.getElementById('clusters-input').value = settings.clusters;
         }
@@ -309,6 +317,7 @@ class FaceClusteringApp {
         if (algorithm === 'dbscan') {
             params.eps = parseFloat(document.getElementById('eps-input').value);
             params.min_samples = parseInt(document.getElementById('min-samples-input').value);
+            params.reassign_noise = document.getElementById('reassign-noise-input').checked;
         } else if (['kmeans', 'hierarchical'].includes(algorithm)) {
             params.n_clusters = parseInt(document.getElementById('clusters-input').value);
         }
@@ -373,11 +382,12 @@ class FaceClusteringApp {
     }
 
     displayResults(data) {
-        const { clusters, statistics } = data;
+        const { clusters, statistics, pagination, result_id } = data;
         
-        // Store cluster data for later use
-        this.clusterData = clusters;
-        console.log('Stored cluster data:', this.clusterData);
+        // Store cluster data for later use (pages are appended as they load)
+        this.clusterData = {};
+        this.clusterResultId = result_id;
+        this.clusterPagination = pagination;
         
         // Update statistics
         document.getElementById('total-faces').textContent = statistics.total_faces;
@@ -389,8 +399,16 @@ class FaceClusteringApp {
         document.getElementById('results-title').textContent = 
             `${statistics.num_clusters} personnes identifiées`;
 
+        // Merge suggestions (large results are analysed in the background)
+        this.displaySummaries(data.summaries);
+        if (data.summaries && !data.summaries.ready) {
+            this.pollSummaries(result_id);
+        }
+
         // Display clusters
+        document.getElementById('clusters-grid').innerHTML = '';
         this.displayClusters(clusters);
+        this.updateLoadMoreButton();
 
         // Show results section
         document.getElementById('results-section').style.display = 'block';
@@ -404,14 +422,81 @@ class FaceClusteringApp {
 
     displayClusters(clusters) {
         const grid = document.getElementById('clusters-grid');
-        grid.innerHTML = '';
 
-        Object.entries(clusters).forEach(([clusterId, cluster]) => {
-            const clusterCard = this.createClusterCard(clusterId, cluster);
+        clusters.forEach(cluster => {
+            this.clusterData[cluster.id] = cluster;
+            const clusterCard = this.createClusterCard(cluster.id, cluster);
             grid.appendChild(clusterCard);
         });
     }
 
+    displaySummaries(summaries) {
+        const container = document.getElementById('merge-suggestions');
+        if (!container) return;
+
+        const suggestions = summaries && summaries.ready ? summaries.merge_suggestions : [];
+        const list = document.getElementById('merge-suggestions-list');
+        list.innerHTML = '';
+        suggestions.forEach(({ clusters, similarity }) => {
+            const item = document.createElement('li');
+            item.textContent = `Personne ${clusters[0] + 1} et Personne ${clusters[1] + 1} ` +
+                `(similarité ${Math.round(similarity * 100)}%)`;
+            list.appendChild(item);
+        });
+        container.style.display = suggestions.length ? 'block' : 'none';
+    }
+
+    async pollSummaries(resultId) {
+        for (let attempt = 0; attempt < 30; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            if (resultId !== this.clusterResultId) return;
+            try {
+                const response = await this.apiCall(`/faces/clusters/${resultId}/summaries`);
+                if (response.summaries.ready) {
+                    if (resultId === this.clusterResultId) {
+                        this.displaySummaries(response.summaries);
+                    }
+                    return;
+                }
+            } catch (error) {
+                console.error('Summaries error:', error);
+                return;
+            }
+        }
+    }
+
+    async loadMoreClusters() {
+        if (!this.clusterResultId || !this.clusterPagination || !this.clusterPagination.has_next) {
+            return;
+        }
+
+        const button = document.getElementById('load-more-clusters');
+        button.disabled = true;
+
+        try {
+            const { page, per_page } = this.clusterPagination;
+            const response = await this.apiCall(
+                `/faces/clusters/${this.clusterResultId}?page=${page + 1}&per_page=${per_page}`
+            );
+            this.clusterPagination = response.pagination;
+            this.displayClusters(response.clusters);
+        } catch (error) {
+            this.showToast(`Erreur lors du chargement: ${error.message}`, 'error');
+            console.error('Load more error:', error);
+        } finally {
+            button.disabled = false;
+            this.updateLoadMoreButton();
+        }
+    }
+
+    updateLoadMoreButton() {
+        const container = document.getElementById('clusters-more');
+        if (!container) return;
+
+        const pagination = this.clusterPagination;
+        container.style.display = pagination && pagination.has_next ? 'block' : 'none';
+    }
+
     createClusterCard(clusterId, cluster) {
         const card = document.createElement('div');
         card.className = 'cluster-card';
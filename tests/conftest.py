@@ -0,0 +1,7 @@
+import pytest
+from app.config import Config
+
+@pytest.fixture(autouse=True)
+def no_background_cleanup(monkeypatch):
+    """Test images do not exist on disk: keep the cleanup thread from dropping them"""
+    monkeypatch.setattr(Config, 'AUTO_CLEANUP', False)
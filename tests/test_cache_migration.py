@@ -0,0 +1,50 @@
+import io
+import json
+import numpy as np
+import pytest
+from app.utils.cache_manager import CacheBudgetExceeded, EmbeddingCache
+from app.utils.cache_migration import import_cache
+from app.utils.json_stream import JsonStreamReader
+
+def _legacy_file(tmp_path, num_images=20):
+    """Legacy {path: [detections]} file; floats like 0.0512 split anywhere"""
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(num_images):
+        data[f"/photos/{i:03d}.jpg"] = [
+            {'box': [10, 20, 30, 40], 'confidence': 0.99,
+             'keypoints': {'left_eye': [15, 25]},
+             'embedding': np.round(rng.standard_normal(512) * 0.1, 6).tolist()}
+            for _ in range(1 + i % 2)
+        ]
+    source = tmp_path / 'legacy.json'
+    source.write_text(json.dumps(data))
+    return source, data
+
+def test_number_split_across_chunks():
+    reader = JsonStreamReader(io.StringIO('[0.05, 1e-5, true]'), chunk_size=2)
+    assert reader.read_value() == [0.05, 1e-5, True]
+    reader = JsonStreamReader(io.StringIO('0.05'), chunk_size=2)
+    assert reader.read_value() == 0.05
+
+@pytest.mark.parametrize('chunk_size', [3, 16, 61, 256, 4096])
+def test_import_independent_of_chunk_size(tmp_path, chunk_size):
+    source, data = _legacy_file(tmp_path)
+    cache = EmbeddingCache(str(tmp_path / 'cache.json'))
+    stats = import_cache(str(source), cache, batch_size=7, backup=False, chunk_size=chunk_size)
+
+    assert stats['images'] == len(data)
+    assert stats['faces'] == sum(len(records) for records in data.values())
+    assert stats['cache_entries'] == len(data)
+    for path, records in data.items():
+        detections = cache.get(path)
+        np.testing.assert_allclose(detections.embeddings,
+                                   [record['embedding'] for record in records], rtol=1e-6)
+
+def test_import_over_budget_fails_without_evicting(tmp_path):
+    source, _ = _legacy_file(tmp_path)
+    cache_file = tmp_path / 'cache.json'
+    cache = EmbeddingCache(str(cache_file), max_entries=10)
+    with pytest.raises(CacheBudgetExceeded):
+        import_cache(str(source), cache, batch_size=4, backup=False)
+    assert not cache_file.exists()
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+from app.services.sharded_extraction import merge_shards, read_shard_file, write_shard_file
+from app.utils.cache_manager import CacheBudgetExceeded, EmbeddingCache
+from app.utils.detection_set import DetectionSet
+
+def _write_shard(tmp_path, num_images, directory='/data/photos'):
+    rng = np.random.default_rng(0)
+    paths = [os.path.join(directory, 'album', f"{i:03d}.jpg") for i in range(num_images)]
+    detections = DetectionSet.from_records([
+        {'image_path': path, 'box': [10, 20, 30, 40], 'confidence': 0.99,
+         'embedding': rng.standard_normal(512).tolist()}
+        for path in paths
+    ])
+    shard = str(tmp_path / 'shard-0000-of-0001.npz')
+    write_shard_file(shard, detections, paths, {'directory': directory, 'created': 1.0},
+                     {paths[1]: {'duplicate_of': paths[0]}})
+    return shard, paths
+
+def test_shard_paths_rebased_onto_root(tmp_path):
+    shard, paths = _write_shard(tmp_path, 3)
+    detections, processed, _, annotations = read_shard_file(shard)
+    assert processed == paths
+    assert sorted(detections.paths) == sorted(paths)
+
+    root = os.path.abspath('/mnt/nas/photos')
+    detections, processed, _, annotations = read_shard_file(shard, root)
+    expected = [os.path.join(root, 'album', f"{i:03d}.jpg") for i in range(3)]
+    assert processed == expected
+    assert annotations == {expected[1]: {'duplicate_of': expected[0]}}
+
+def test_merge_over_budget_fails_without_evicting(tmp_path):
+    shard, _ = _write_shard(tmp_path, 20)
+    cache_file = tmp_path / 'cache.json'
+    with pytest.raises(CacheBudgetExceeded):
+        merge_shards([shard], EmbeddingCache(str(cache_file), max_entries=10))
+    assert not cache_file.exists()
+
+    stats = merge_shards([shard], EmbeddingCache(str(cache_file), max_entries=20))
+    assert stats['images'] == stats['cache_entries'] == 20